@@ -1,13 +1,33 @@
 import streamlit as st
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
 import os
+import asyncio
 import openai # Added
+import httpx # Shared connection pool for the async LLM clients
 import anthropic # Added
+from aiolimiter import AsyncLimiter # Requests-per-minute cap for live LLM calls
+from tenacity import AsyncRetrying, before_sleep_log, retry_if_exception_type, wait_random_exponential
 import csv
 import time
 import pandas as pd
+import pyarrow as pa
 import io # For CSV parsing from string/bytes
-import json # For saving/loading configurations
+import re
+import queue # Events from the background generation loop to the UI
+import threading
+import hashlib # For LLM response cache keys
+import sqlite3
+import tempfile
+import functools
+import diskcache # Persistent on-disk LLM response cache
+import json
+import orjson # Fast config save/load
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from html_audit import audit_article, audit_row, build_link_matcher, init_audit_worker # Module-level so process-pool workers can import them
 from datetime import datetime # For naming config files
 
 # --- 1. CONFIGURATION & API KEY ---
@@ -16,6 +36,14 @@ from datetime import datetime # For naming config files
 GEMINI_API_KEY = st.secrets.get("GEMINI_API_KEY", os.getenv("GEMINI_API_KEY"))
 OPENAI_API_KEY = st.secrets.get("OPENAI_API_KEY", os.getenv("OPENAI_API_KEY")) # Added
 ANTHROPIC_API_KEY = st.secrets.get("ANTHROPIC_API_KEY", os.getenv("ANTHROPIC_API_KEY")) # Added
+# Cache directories default to the temp dir: serverless hosts (e.g. Vercel) only allow writes under /tmp.
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", os.path.join(tempfile.gettempdir(), "seo_content_engine_llm_cache")) # Where identical LLM calls are cached across reruns/sessions
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", 24 * 60 * 60)) or None # 0 = keep responses until cleared
+BATCH_MANIFEST_DIR = os.getenv("BATCH_MANIFEST_DIR", os.path.join(tempfile.gettempdir(), "seo_content_engine_batch_manifests")) # Submitted batch jobs, kept apart from the LLM cache
+
+# Per-call diagnostics go to the server log instead of the page. Set LOG_LEVEL=DEBUG to see them.
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING"))
+logger = logging.getLogger("seo_content_engine")
 
 # --- DEFAULT VALUES (Bastian can override in UI / load from config) ---
 DEFAULT_MODEL_NAME = "gemini-2.5-pro-exp-03-25" # Updated default to suggested experimental model
@@ -97,21 +125,92 @@ Link Inclusion Targets (numbers): Internal Links: [TARGET_NUMBER_INTERNAL_LINKS]
     ALL external links, whether from the approved list or newly sourced, MUST add significant, direct value to the reader. Avoid generic links. Ensure anchor text is descriptive and natural. Absolutely NO links to competitor websites.
 8.  Quality & Accuracy: Factually accurate, current, helpful. No fabricated info. Original.
 Output Instructions: Output ONLY raw HTML for article body. NO `<html>`, `<head>`, `<body>` tags. NO MARKDOWN FENCES (```html). No other text/labels/preambles.
+    """,
+    "batched_fields": """
+Task: Generate the short SEO fields for an article on Workstream's website, all in one answer.
+Topic (from CSV/Input): [TOPIC_INPUT]
+Primary Keyword (from CSV/Input): [PRIMARY_KEYWORD]
+Secondary Keywords (from CSV/Input, comma-separated): [SECONDARY_KEYWORDS_LIST]
+Workstream Brand Guidelines: [WORKSTREAM_BRAND_GUIDELINES]
+SEO Best Practices Summary: [SEO_BEST_PRACTICES_SUMMARY]
+Fields and Constraints:
+[1] page_title: Max 60 chars. Compelling, SEO-friendly. Include [PRIMARY_KEYWORD].
+[2] meta_description: 140-160 chars. Engaging. Include [PRIMARY_KEYWORD] & ideally a [SECONDARY_KEYWORDS_LIST] keyword. CTA.
+[3] h1_tag: Max 100 chars (aim 60-70). Clear, user-focused, reflect [PRIMARY_KEYWORD]/[TOPIC_INPUT].
+[4] subtitle: Max 200 chars. Value-proposition focused for [TOPIC_INPUT]. Wrap in a SINGLE <p class="lead"> tag.
+[5] alt_text: Alt Text for ONE representative image. 10-15 words ideally (max 125 chars). Include [PRIMARY_KEYWORD] if natural. NO "Image of...".
+Output Instructions: Output exactly 5 lines, one per field, each starting with its marker and name, e.g. `[1] page_title: Your Title`. No extra text/quotes/markdown.
     """
 }
 
+# Output budget per field. Tight caps on the short fields stop runaway answers and let providers schedule the
+# request with a smaller reservation. Not sent to Gemini: 2.5 models spend "thinking" tokens from the same budget.
+FIELD_MAX_OUTPUT_TOKENS = {
+    "page_title": 60, "meta_description": 120, "h1_tag": 80,
+    "subtitle": 120, "alt_text": 60, "main_text_html": 4000, # ~2x a 1100-word HTML article, so only runaway answers hit it
+}
+DEFAULT_MAX_OUTPUT_TOKENS = 2000
+
+# Context windows, used to refuse prompts that cannot fit before paying for a round trip.
+MODEL_CONTEXT_TOKENS = {
+    "gemini-2.5-pro-exp-03-25": 1_048_576,
+    "gpt-4.1": 1_047_576,
+    "claude-3-7-sonnet-20250219": 200_000,
+}
+DEFAULT_CONTEXT_TOKENS = 128_000
+
+# Every [PLACEHOLDER] the system fills.
+PLACEHOLDER_PATTERN = re.compile(
+    r"\[(TOPIC_INPUT|PRIMARY_KEYWORD|SECONDARY_KEYWORDS_LIST|WORKSTREAM_BRAND_GUIDELINES|SEO_BEST_PRACTICES_SUMMARY"
+    r"|APPROVED_INTERNAL_LINKS_TEXT|APPROVED_EXTERNAL_LINKS_TEXT|TARGET_NUMBER_INTERNAL_LINKS|TARGET_NUMBER_EXTERNAL_LINKS)\]"
+)
+# The only placeholders that change from topic to topic; the rest are pre-filled once per run.
+TOPIC_PLACEHOLDERS = ("TOPIC_INPUT", "PRIMARY_KEYWORD", "SECONDARY_KEYWORDS_LIST")
+# A placeholder or a literal brace: what has to be rewritten to turn a template into str.format_map form.
+PREFILL_TOKEN_PATTERN = re.compile(PLACEHOLDER_PATTERN.pattern + r"|([{}])")
+
 # --- CSV Column Headers ---
 CSV_COLUMN_HEADERS = [
     "topic_input", "primary_keyword", "secondary_keywords",
     "page_title", "meta_description", "h1_tag", "subtitle", "alt_text", "main_text_html",
-    "found_internal_links_in_html", "found_external_links_in_html"
+    "found_internal_links_in_html", "found_external_links_in_html", "html_issues"
 ]
 
+# Input columns of the topics table, in CSV order.
+TOPIC_COLUMNS = ['topic_input', 'primary_keyword', 'secondary_keywords']
+
+# Content pieces generated for every topic, in CSV order.
+GENERATION_FIELDS = ["page_title", "meta_description", "h1_tag", "subtitle", "alt_text", "main_text_html"]
+
+# Short fields the "batched_fields" prompt asks for in one call, and the `[n] field_name:` markers that split its answer.
+BATCHED_FIELDS = ["page_title", "meta_description", "h1_tag", "subtitle", "alt_text"]
+BATCHED_FIELDS_PROMPT_KEY = "batched_fields"
+BATCHED_FIELD_MARKER_PATTERN = re.compile(r"^\s*\[\d+\]\s*(\w+):[ \t]*", re.MULTILINE)
+
+# `[n]` position markers that split a multi-topic answer for one short field.
+MARSHALED_ANSWER_MARKER_PATTERN = re.compile(r"^\s*\[(\d+)\][ \t]*", re.MULTILINE)
+
 # --- SESSION STATE INITIALIZATION ---
+def as_topics_frame(df):
+    # Exactly TOPIC_COLUMNS as Arrow-backed strings: a fraction of the memory of object columns, and no
+    # per-cell conversion when the frame is handed to Arrow (data_editor, config export).
+    return df.reindex(columns=TOPIC_COLUMNS, fill_value="").astype("string[pyarrow]")
+
+# Parsed once per process instead of on every rerun. Both are shared across sessions, so treat them as read-only.
+@st.cache_resource
+def get_default_topics_df():
+    try:
+        return as_topics_frame(pd.read_csv(io.StringIO(DEFAULT_TOPICS_KEYWORDS_CSV_STRING)))
+    except pd.errors.EmptyDataError:
+        return as_topics_frame(pd.DataFrame(columns=TOPIC_COLUMNS))
+
+@st.cache_resource
+def get_default_prompts():
+    return PROMPT_TEMPLATES_DEFAULTS
+
 def init_session_state():
     defaults = {
         'model_name': DEFAULT_MODEL_NAME,
-        'topics_df': pd.DataFrame(columns=['topic_input', 'primary_keyword', 'secondary_keywords']), 
         'uploaded_topics_filename': None,
         'approved_internal_links': DEFAULT_APPROVED_INTERNAL_LINKS,
         'approved_external_links': DEFAULT_APPROVED_EXTERNAL_LINKS,
@@ -120,7 +219,12 @@ def init_session_state():
         'target_internal_links': 2,
         'target_external_links': 1,
         'llm_temperature': 0.6,
-        'editable_prompts': PROMPT_TEMPLATES_DEFAULTS.copy(),
+        'max_concurrency': 8,
+        'requests_per_minute': 0, # 0 = no rate limit
+        'combine_short_fields': False,
+        'topics_per_request': 1, # 1 = one topic per short-field request
+        'use_batch_api': False,
+        'editable_prompts': get_default_prompts(), # Replaced (never mutated) when a prompt is edited
         'config_loaded_successfully': False,
         'active_config_name': "Defaults"
     }
@@ -128,164 +232,931 @@ def init_session_state():
         if key not in st.session_state:
             st.session_state[key] = default_value
     
-    if st.session_state.topics_df.empty:
-        try:
-            default_df = pd.read_csv(io.StringIO(DEFAULT_TOPICS_KEYWORDS_CSV_STRING))
-            st.session_state.topics_df = default_df
-        except pd.errors.EmptyDataError: 
-             st.session_state.topics_df = pd.DataFrame(columns=['topic_input', 'primary_keyword', 'secondary_keywords'])
+    if 'topics_df' not in st.session_state or st.session_state.topics_df.empty:
+        st.session_state.topics_df = get_default_topics_df().copy()
 
 init_session_state()
 
 
+# --- TOPICS CSV PARSING ---
+@st.cache_data(show_spinner=False)
+def parse_topics_csv(csv_bytes):
+    # Cached on the file's bytes, so the uploader doesn't re-parse the same file on every rerun.
+    try:
+        df = pd.read_csv(io.BytesIO(csv_bytes), engine="pyarrow") # Multi-threaded Arrow parser
+    except (ImportError, ValueError):
+        df = pd.read_csv(io.BytesIO(csv_bytes)) # e.g. pyarrow rejects newlines inside quoted values
+    return as_topics_frame(df)
+
 # --- CONFIGURATION SAVE/LOAD FUNCTIONS ---
 def get_current_config_dict():
     config = {}
     for key in ['model_name', 'approved_internal_links', 'approved_external_links',
                 'brand_guidelines', 'seo_summary', 'target_internal_links',
-                'target_external_links', 'llm_temperature', 'editable_prompts']:
+                'target_external_links', 'llm_temperature', 'max_concurrency', 'requests_per_minute', 'combine_short_fields', 'topics_per_request', 'editable_prompts']:
         config[key] = st.session_state[key]
-    config['topics_df_as_list'] = st.session_state.topics_df.to_dict(orient='records')
+    config['topics_df_as_list'] = pa.Table.from_pandas(st.session_state.topics_df, preserve_index=False).to_pylist() # Empty cells become null
     return config
 
 def load_config_from_dict(config_dict):
     for key, value in config_dict.items():
         if key == 'topics_df_as_list': 
-            st.session_state.topics_df = pd.DataFrame(value)
+            st.session_state.topics_df = as_topics_frame(pd.DataFrame(value))
         elif key in st.session_state:
             st.session_state[key] = value
     st.session_state.config_loaded_successfully = True
 
-# --- GEMINI API INTERACTION FUNCTION ---
-def generate_content(prompt_text, model_name, temperature, retries=3, delay_seconds=5):
-    st.write(f"Attempting to generate content with model: {model_name}, Temperature: {temperature}")
+# --- LLM CLIENTS ---
+# Built once per process and reused by every call, so connections (and their TLS sessions) survive across the batch.
+# The async clients are bound to the generation loop and must only be awaited there.
+LLM_HTTP_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=32)
+LLM_HTTP_TIMEOUT_SECONDS = 120.0
+
+@st.cache_resource
+def get_llm_http_client():
+    # One HTTP/2 pool shared by every provider client: concurrent calls multiplex over a few connections per
+    # host instead of each opening its own TCP+TLS connection.
+    return httpx.AsyncClient(http2=True, limits=LLM_HTTP_LIMITS, timeout=LLM_HTTP_TIMEOUT_SECONDS)
+
+@st.cache_resource
+def get_llm_client(model_name):
+    # Async client (or Gemini model) for live generation; None when the provider's key is missing.
+    if "gemini" in model_name and GEMINI_API_KEY:
+        genai.configure(api_key=GEMINI_API_KEY)
+        return genai.GenerativeModel(model_name)
+    elif "gpt" in model_name and OPENAI_API_KEY:
+        return openai.AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=0, http_client=get_llm_http_client())
+    elif "claude" in model_name and ANTHROPIC_API_KEY:
+        return anthropic.AsyncAnthropic(api_key=ANTHROPIC_API_KEY, max_retries=0, http_client=get_llm_http_client())
+    return None
+
+@st.cache_resource
+def get_batch_client(model_name):
+    # Sync client for the provider Batch API path; None when the provider's key is missing.
+    if "gpt" in model_name and OPENAI_API_KEY:
+        return openai.OpenAI(api_key=OPENAI_API_KEY)
+    elif "claude" in model_name and ANTHROPIC_API_KEY:
+        return anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
+    return None
+
+@st.cache_resource
+def get_rate_limiter(model_name, requests_per_minute):
+    # Provider RPM limits apply per API key, not per run, so every session and job on this server using the same
+    # model and limit shares one limiter. Only ever awaited on the generation loop.
+    return AsyncLimiter(requests_per_minute, 60)
+
+# --- LLM API INTERACTION FUNCTION (ASYNC) ---
+GEMINI_SAFETY_SETTINGS = [
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+]
+
+class EmptyResponseError(Exception):
+    # The provider answered but gave us no usable text (e.g. Gemini safety block). Worth retrying.
+    pass
+
+class TruncatedResponseError(Exception):
+    # The answer hit its output token cap and was cut off. Not retried (the same cap would cut it again) and never cached.
+    pass
+
+# Only transient failures are retried; auth and bad-request errors fail on the first attempt.
+RETRYABLE_LLM_ERRORS = (
+    EmptyResponseError,
+    openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError,
+    anthropic.RateLimitError, anthropic.APIConnectionError, anthropic.InternalServerError,
+    google_exceptions.ResourceExhausted, google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError, google_exceptions.DeadlineExceeded,
+)
+# 429s clear once the provider's window rolls over, so they get more (and longer) backoff attempts than other errors.
+RATE_LIMIT_ERRORS = (openai.RateLimitError, anthropic.RateLimitError, google_exceptions.ResourceExhausted)
+RATE_LIMIT_RETRY_ATTEMPTS = 6
+LLM_RETRY_MAX_WAIT_SECONDS = 30
+
+def stop_llm_retries(retries):
+    # tenacity stop condition: `retries` attempts in general, RATE_LIMIT_RETRY_ATTEMPTS while the provider is rate limiting.
+    def should_stop(retry_state):
+        attempt_limit = RATE_LIMIT_RETRY_ATTEMPTS if isinstance(retry_state.outcome.exception(), RATE_LIMIT_ERRORS) else retries
+        return retry_state.attempt_number >= attempt_limit
+    return should_stop
+
+# Streamed text is forwarded to the UI at most every 200ms or 50 chunks, so previews don't flood the event queue.
+PREVIEW_FLUSH_SECONDS = 0.2
+PREVIEW_FLUSH_CHUNKS = 50
+
+# href targets of <a> tags, scanned incrementally while the article streams in.
+PREVIEW_HREF_PATTERN = re.compile(r"""<a\s[^>]*?href\s*=\s*["']([^"']+)["']""", re.IGNORECASE)
+
+def make_preview_emitter(events, preview_label):
+    # Returns on_chunk(buffer, final) which posts the text streamed so far, plus the link targets seen in it,
+    # as a throttled "preview" event.
+    last_flush = [time.monotonic()]
+    pending_chunks = [0]
+    scan_from = [0]
+    linked_keys = set() # trailing slash stripped, like approved_url_keys
+    def on_chunk(buffer, final=False):
+        pending_chunks[0] += 1
+        now = time.monotonic()
+        if final or pending_chunks[0] >= PREVIEW_FLUSH_CHUNKS or now - last_flush[0] >= PREVIEW_FLUSH_SECONDS:
+            streamed_text = buffer.getvalue()
+            for href_match in PREVIEW_HREF_PATTERN.finditer(streamed_text, scan_from[0]):
+                linked_keys.add(href_match.group(1).strip().rstrip("/"))
+            # Next scan resumes at a tag still being streamed, so only new text is searched but no split link is missed.
+            last_tag_start = streamed_text.rfind("<", scan_from[0])
+            unclosed_tag = last_tag_start != -1 and streamed_text.find(">", last_tag_start) == -1
+            scan_from[0] = last_tag_start if unclosed_tag else len(streamed_text)
+            events.put(("preview", preview_label, streamed_text, frozenset(linked_keys)))
+            last_flush[0], pending_chunks[0] = now, 0
+    return on_chunk
+
+def estimate_prompt_tokens(prompt_text):
+    # Deliberately pessimistic (~3 chars/token; English averages ~4) so the context check never lets an oversize prompt through.
+    return len(prompt_text) // 3 + 1
+
+async def acall_gemini(model, prompt_text, model_name, temperature, max_output_tokens, on_chunk=None):
+    generation_config = genai.types.GenerationConfig(temperature=temperature)
+    response = await model.generate_content_async(prompt_text, generation_config=generation_config, safety_settings=GEMINI_SAFETY_SETTINGS, stream=True)
+    buffer = io.StringIO()
+    async for chunk in response:
+        if chunk.candidates and chunk.candidates[0].content.parts:
+            buffer.write(chunk.text)
+            if on_chunk: on_chunk(buffer)
+    if buffer.tell():
+        if on_chunk: on_chunk(buffer, final=True)
+        return buffer.getvalue().strip()
+    fb = response.prompt_feedback
+    raise EmptyResponseError(f"Blocked - {fb.block_reason if fb else 'Unknown'}")
+
+async def acall_openai(client, prompt_text, model_name, temperature, max_output_tokens, on_chunk=None):
+    stream = await client.chat.completions.create(
+        model=model_name,
+        messages=[{"role": "user", "content": prompt_text}],
+        temperature=temperature,
+        max_completion_tokens=max_output_tokens,
+        stream=True
+    )
+    buffer = io.StringIO()
+    finish_reason = None
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            buffer.write(chunk.choices[0].delta.content)
+            if on_chunk: on_chunk(buffer)
+        if chunk.choices and chunk.choices[0].finish_reason:
+            finish_reason = chunk.choices[0].finish_reason
+    if finish_reason == "length":
+        raise TruncatedResponseError(f"OpenAI response cut off at the {max_output_tokens}-token output limit.")
+    if buffer.tell():
+        if on_chunk: on_chunk(buffer, final=True)
+        return buffer.getvalue().strip()
+    raise EmptyResponseError("OpenAI response empty after retries.")
+
+async def acall_anthropic(client, prompt_text, model_name, temperature, max_output_tokens, on_chunk=None):
+    buffer = io.StringIO()
+    async with client.messages.stream(
+        model=model_name,
+        max_tokens=max_output_tokens,
+        temperature=temperature,
+        messages=[{"role": "user", "content": prompt_text}]
+    ) as stream:
+        async for text in stream.text_stream:
+            buffer.write(text)
+            if on_chunk: on_chunk(buffer)
+        final_message = await stream.get_final_message()
+    if final_message.stop_reason == "max_tokens":
+        raise TruncatedResponseError(f"Anthropic response cut off at the {max_output_tokens}-token output limit.")
+    if buffer.tell():
+        if on_chunk: on_chunk(buffer, final=True)
+        return buffer.getvalue().strip()
+    raise EmptyResponseError("Anthropic response empty/invalid after retries.")
+
+async def agenerate_content(prompt_text, model_name, temperature, llm_client, events, retries=3, preview_label=None, max_output_tokens=DEFAULT_MAX_OUTPUT_TOKENS):
+    # Runs on the background generation loop. Only terminal failures reach the UI (via `events`); the rest is logged.
+    logger.debug("Attempting to generate content with model: %s, Temperature: %s", model_name, temperature)
 
     if "gemini" in model_name:
-        if not GEMINI_API_KEY: 
-            st.error("GEMINI_API_KEY not configured.")
-            st.write("Error: GEMINI_API_KEY not configured.")
-            return "ERROR: API Key missing."
+        provider, api_key_name, api_key, acall_provider = "Gemini", "GEMINI_API_KEY", GEMINI_API_KEY, acall_gemini
+    elif "gpt" in model_name:
+        provider, api_key_name, api_key, acall_provider = "OpenAI", "OPENAI_API_KEY", OPENAI_API_KEY, acall_openai
+    elif "claude" in model_name:
+        provider, api_key_name, api_key, acall_provider = "Anthropic", "ANTHROPIC_API_KEY", ANTHROPIC_API_KEY, acall_anthropic
+    else:
+        events.put(("error", f"Unsupported model provider for model: {model_name}"))
+        return "ERROR: Unsupported model provider."
+    if not api_key:
+        events.put(("error", f"{api_key_name} not configured."))
+        return "ERROR: API Key missing."
+    prompt_tokens = estimate_prompt_tokens(prompt_text)
+    if prompt_tokens > MODEL_CONTEXT_TOKENS.get(model_name, DEFAULT_CONTEXT_TOKENS) - max_output_tokens:
+        events.put(("error", f"Prompt of ~{prompt_tokens} tokens is too long for {model_name}. Shorten the prompt or link lists."))
+        return f"ERROR: Prompt too long (~{prompt_tokens} tokens)."
+
+    try:
+        # Jittered exponential backoff awaits asyncio.sleep, so waiting calls never block the loop or each other.
+        async for attempt in AsyncRetrying(
+            stop=stop_llm_retries(retries),
+            wait=wait_random_exponential(multiplier=1, max=LLM_RETRY_MAX_WAIT_SECONDS),
+            retry=retry_if_exception_type(RETRYABLE_LLM_ERRORS),
+            before_sleep=before_sleep_log(logger, logging.WARNING),
+            reraise=True,
+        ):
+            with attempt:
+                # A fresh emitter per attempt: a retried stream starts from an empty buffer, so the link scan must too.
+                on_chunk = make_preview_emitter(events, preview_label) if preview_label else None
+                generated_text = await acall_provider(llm_client, prompt_text, model_name, temperature, max_output_tokens, on_chunk)
+        logger.debug("%s response successful: %.100s...", provider, generated_text)
+        return generated_text
+    except EmptyResponseError as e:
+        events.put(("warning", f"{provider} response empty/blocked: {e}"))
+        return f"ERROR: {e}"
+    except TruncatedResponseError as e:
+        events.put(("warning", f"Truncated answer discarded: {e}"))
+        return f"ERROR: {e}"
+    except Exception as e:
+        events.put(("error", f"{provider} API Error: {e}"))
+        return f"ERROR: API call failed - {e}"
+
+# --- LLM RESPONSE CACHE ---
+class DisabledCache:
+    # Stand-in for a cache directory that can't be opened: nothing is stored and every lookup misses.
+    def get(self, key, default=None):
+        return default
+    def set(self, key, value, expire=None):
+        return False
+    def delete(self, key):
+        return False
+    def clear(self):
+        return 0
+    def __len__(self):
+        return 0
+
+def open_disk_cache(cache_dir):
+    # An unwritable directory must not stop the page from rendering; the app just runs without that cache.
+    try:
+        return diskcache.Cache(cache_dir)
+    except (OSError, sqlite3.Error) as e:
+        logger.warning("Cache directory %s unavailable, continuing without it: %s", cache_dir, e)
+        return DisabledCache()
+
+@st.cache_resource
+def get_llm_cache():
+    return open_disk_cache(LLM_CACHE_DIR)
+
+@st.cache_resource
+def get_batch_manifest_cache():
+    # Its own store, so "Clear LLM Cache" and the stored-response count leave submitted batches alone.
+    return open_disk_cache(BATCH_MANIFEST_DIR)
+
+def llm_cache_key(prompt_text, model_name, temperature):
+    prompt_hash = hashlib.blake2b(prompt_text.encode('utf-8')).hexdigest()
+    return f"{model_name}|{round(temperature, 3)}|{prompt_hash}"
+
+# --- PER-TOPIC GENERATION ---
+def empty_results_columns(row_count):
+    # Column-oriented results table: one pre-sized list per CSV column, filled in place by row index.
+    return {column: [None] * row_count for column in CSV_COLUMN_HEADERS}
+
+def build_prompt_context():
+    # Snapshot of the topic-independent placeholders, taken on the script thread before a job starts.
+    return {
+        "WORKSTREAM_BRAND_GUIDELINES": st.session_state.brand_guidelines,
+        "SEO_BEST_PRACTICES_SUMMARY": st.session_state.seo_summary,
+        "APPROVED_INTERNAL_LINKS_TEXT": st.session_state.approved_internal_links,
+        "APPROVED_EXTERNAL_LINKS_TEXT": st.session_state.approved_external_links,
+        "TARGET_NUMBER_INTERNAL_LINKS": str(st.session_state.target_internal_links),
+        "TARGET_NUMBER_EXTERNAL_LINKS": str(st.session_state.target_external_links),
+    }
+
+def placeholder_text(value):
+    # Empty CSV cells (NaN/None) become blank text.
+    return "" if pd.isna(value) else str(value)
+
+@functools.lru_cache(maxsize=64)
+def prefill_prompt_template(prompt_template, prompt_context_items):
+    # One pass per template and context: the topic-independent placeholders (brand, SEO summary, link lists,
+    # targets) are substituted, topic placeholders become {NAME} and literal braces are escaped. Each topic
+    # then only needs a format_map over its three values.
+    static_values = {name: placeholder_text(value).replace("{", "{{").replace("}", "}}") for name, value in prompt_context_items}
+    def template_token(match):
+        placeholder_name, literal_brace = match.groups()
+        if literal_brace:
+            return literal_brace * 2
+        return "{" + placeholder_name + "}" if placeholder_name in TOPIC_PLACEHOLDERS else static_values[placeholder_name]
+    return PREFILL_TOKEN_PATTERN.sub(template_token, prompt_template)
+
+@functools.lru_cache(maxsize=4096)
+def fill_topic_prompt(prompt_template, prompt_context_items, topic_input, primary_keyword, secondary_keywords):
+    # Memoized on hashable inputs, so repeated topic rows (and reruns of the same job) skip substitution entirely.
+    return prefill_prompt_template(prompt_template, prompt_context_items).format_map({
+        "TOPIC_INPUT": placeholder_text(topic_input),
+        "PRIMARY_KEYWORD": placeholder_text(primary_keyword),
+        "SECONDARY_KEYWORDS_LIST": placeholder_text(secondary_keywords),
+    })
+
+def build_topic_prompts(topic_row, prompt_templates, prompt_context, fields=GENERATION_FIELDS):
+    # Fill every field's prompt template for one topic. Fields without a template are left out.
+    prompt_context_items = tuple(prompt_context.items())
+    topic_values = (topic_row.get('topic_input', 'N/A'), topic_row.get('primary_keyword', ''), topic_row.get('secondary_keywords', ''))
+    return {
+        field_to_gen: fill_topic_prompt(prompt_templates[field_to_gen], prompt_context_items, *topic_values)
+        for field_to_gen in fields if prompt_templates.get(field_to_gen)
+    }
+
+def parse_batched_fields(response_text):
+    # Split a "batched_fields" answer on its `[n] field_name:` markers. None unless every short field came back non-empty.
+    parts = BATCHED_FIELD_MARKER_PATTERN.split(response_text)
+    parsed = {name: text.strip() for name, text in zip(parts[1::2], parts[2::2])}
+    if all(parsed.get(field_to_gen) for field_to_gen in BATCHED_FIELDS):
+        return {field_to_gen: parsed[field_to_gen] for field_to_gen in BATCHED_FIELDS}
+    return None
+
+def build_marshaled_prompt(prompts):
+    # Several topics' prompts for the same field, numbered so the answers can be matched back by position.
+    numbered_prompts = "\n\n".join(f"[{position}] {prompt_text.strip()}" for position, prompt_text in enumerate(prompts, 1))
+    return (
+        f"Complete each of the {len(prompts)} numbered tasks below independently.\n"
+        f"Output exactly {len(prompts)} lines, one per task and in order, each starting with its number, e.g. `[1] Your answer`. No other text.\n\n"
+        f"{numbered_prompts}"
+    )
+
+def parse_marshaled_answers(response_text, expected_count):
+    # Answers in task order, or None unless positions 1..expected_count each came back exactly once and non-empty.
+    parts = MARSHALED_ANSWER_MARKER_PATTERN.split(response_text)
+    positions = [int(position) for position in parts[1::2]]
+    if sorted(positions) != list(range(1, expected_count + 1)):
+        return None
+    answers = dict(zip(positions, (text.strip() for text in parts[2::2])))
+    if not all(answers.values()):
+        return None
+    return [answers[position] for position in range(1, expected_count + 1)]
+
+def make_cached_generator(settings, events, job_tasks):
+    # One per job, created on the generation loop. The shared semaphore bounds in-flight calls and the
+    # limiter spaces them out to the provider's RPM. Shared calls are added to `job_tasks` for cancellation.
+    semaphore = asyncio.Semaphore(settings['max_concurrency'])
+    rate_limiter = settings['rate_limiter']
+    inflight_calls = {} # cache key -> task, so each unique prompt is sent once per job
+    model_name, temperature = settings['model_name'], settings['llm_temperature']
+    llm_cache = settings['llm_cache']
+
+    async def generate_uncached(prompt_text, cache_key, max_output_tokens, preview_label, is_valid):
+        async with semaphore:
+            if rate_limiter is not None:
+                await rate_limiter.acquire()
+            try:
+                generated_val = await agenerate_content(
+                    prompt_text, model_name, temperature, settings['llm_client'], events,
+                    preview_label=preview_label, max_output_tokens=max_output_tokens
+                )
+            except Exception as e:
+                return f"ERROR: API call failed - {e}"
+        if not generated_val.startswith("ERROR:") and (is_valid is None or is_valid(generated_val)):
+            await asyncio.to_thread(llm_cache.set, cache_key, generated_val, expire=LLM_CACHE_TTL_SECONDS)
+        return generated_val
+
+    async def generate_cached(prompt_text, max_output_tokens, preview_label=None, is_valid=None):
+        # Identical (model, temperature, prompt) calls are served from disk without touching the provider.
+        # is_valid(text) gates caching for answers that still have to be parsed, so a malformed one is retried next run.
+        cache_key = llm_cache_key(prompt_text, model_name, temperature)
+        # diskcache is blocking SQLite I/O; run it on the default thread pool so the event loop keeps streaming.
+        cached_val = await asyncio.to_thread(llm_cache.get, cache_key)
+        if cached_val is not None and (is_valid is None or is_valid(cached_val)):
+            return cached_val
+        # Identical prompts elsewhere in this job (e.g. duplicate topic rows) share one provider call.
+        if cache_key not in inflight_calls:
+            inflight_calls[cache_key] = asyncio.ensure_future(generate_uncached(prompt_text, cache_key, max_output_tokens, preview_label, is_valid))
+            job_tasks.add(inflight_calls[cache_key])
+        return await inflight_calls[cache_key]
+
+    return generate_cached
+
+async def generate_marshaled_field(field_to_gen, prompts, generate_cached, events):
+    # One request answers `field_to_gen` for several topics. None means "fall back to one request per topic".
+    max_output_tokens = (FIELD_MAX_OUTPUT_TOKENS[field_to_gen] + 10) * len(prompts) # + room for each marker
+    def is_valid(answer_text):
+        return parse_marshaled_answers(answer_text, len(prompts)) is not None
+    generated_val = await generate_cached(build_marshaled_prompt(prompts), max_output_tokens, is_valid=is_valid)
+    if generated_val.startswith("ERROR:"):
+        return [generated_val] * len(prompts)
+    answers = parse_marshaled_answers(generated_val, len(prompts))
+    if answers is None:
+        events.put(("warning", f"Multi-topic '{field_to_gen}' answer didn't have one line per topic; generating those topics one by one."))
+    return answers
+
+async def process_topic(topic_row, settings, generate_cached, events, marshaled_pieces=None):
+    # All fields of a topic are independent, so the topic takes as long as its slowest field.
+    # marshaled_pieces maps a short field to (callable returning the shared multi-topic task, this topic's position in it).
+    topic_input_val = topic_row.get('topic_input', 'N/A')
+    output_row = {"topic_input": topic_input_val, "primary_keyword": topic_row.get('primary_keyword', ''), "secondary_keywords": topic_row.get('secondary_keywords', '')}
+    topic_prompts = build_topic_prompts(topic_row, settings['prompt_templates'], settings['prompt_context'])
+    for field_to_gen in GENERATION_FIELDS:
+        if field_to_gen not in topic_prompts:
+            output_row[field_to_gen] = "ERROR: No Prompt"
+            events.put(("warning", f"Prompt for '{field_to_gen}' missing for '{topic_input_val}'."))
+    marshaled_pieces = marshaled_pieces or {}
+
+    async def generate_piece(field_to_gen):
+        if field_to_gen in marshaled_pieces:
+            start_group_task, position = marshaled_pieces[field_to_gen]
+            group_answers = await start_group_task()
+            if group_answers is not None:
+                return [(field_to_gen, group_answers[position])]
+        # Only the long-form body is previewed live; the short fields finish in a second or two anyway.
+        preview_label = f"{topic_input_val} · {field_to_gen}" if field_to_gen == "main_text_html" else None
+        max_output_tokens = FIELD_MAX_OUTPUT_TOKENS.get(field_to_gen, DEFAULT_MAX_OUTPUT_TOKENS)
+        return [(field_to_gen, await generate_cached(topic_prompts[field_to_gen], max_output_tokens, preview_label))]
+
+    async def guard_piece(piece_fields, piece_job):
+        # gather(return_exceptions=True), per piece: a failure becomes ERROR text in that piece's fields only,
+        # and the topic's other fields keep their answers.
         try:
-            st.write(f"Configuring Gemini with API key: {'*' * (len(GEMINI_API_KEY) - 4) + GEMINI_API_KEY[-4:] if GEMINI_API_KEY else 'Not Set'}")
-            genai.configure(api_key=GEMINI_API_KEY)
-            model = genai.GenerativeModel(model_name)
-            generation_config = genai.types.GenerationConfig(temperature=temperature)
-            safety_settings = [
-                {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-                {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-                {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-                {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            ]
-            for attempt in range(retries):
-                try:
-                    st.write(f"Gemini API call attempt {attempt + 1}")
-                    response = model.generate_content(prompt_text, generation_config=generation_config, safety_settings=safety_settings)
-                    if response.candidates and response.candidates[0].content.parts:
-                        generated_text = response.text.strip()
-                        st.write(f"Gemini response successful: {generated_text[:100]}...")
-                        return generated_text
-                    else:
-                        fb = response.prompt_feedback
-                        reason = fb.block_reason if fb else "Unknown"
-                        st.warning(f"Gemini response empty/blocked. Reason: {reason}")
-                        st.write(f"Gemini response empty/blocked. Reason: {reason}, Attempt: {attempt+1}")
-                        if attempt < retries - 1: time.sleep(delay_seconds * (attempt + 1))
-                        else: return f"ERROR: Blocked - {reason}"
-                except Exception as e:
-                    st.error(f"Gemini API Error (Attempt {attempt+1}): {e}")
-                    st.write(f"Gemini API Error (Attempt {attempt+1}): {e}")
-                    if attempt < retries - 1: time.sleep(delay_seconds * (attempt + 1))
-                    else: return f"ERROR: API call failed - {e}"
-            st.write("Gemini max retries reached.")
-            return "ERROR: Max retries."
+            return await piece_job
         except Exception as e:
-            st.error(f"Gemini Config/Setup Error: {e}")
-            st.write(f"Gemini Config/Setup Error: {e}")
-            return f"ERROR: Setup - {e}"
+            events.put(("error", f"{', '.join(piece_fields)} failed for '{topic_input_val}': {e}"))
+            return [(field_to_gen, f"ERROR: Generation failed - {e}") for field_to_gen in piece_fields]
 
-    elif "gpt" in model_name:
-        if not OPENAI_API_KEY:
-            st.error("OPENAI_API_KEY not configured.")
-            st.write("Error: OPENAI_API_KEY not configured.")
-            return "ERROR: API Key missing."
+    async def generate_batched_fields(batched_prompt):
+        # One call for all short fields; if the answer can't be split, fall back to one call per field.
+        max_output_tokens = sum(FIELD_MAX_OUTPUT_TOKENS[field_to_gen] for field_to_gen in BATCHED_FIELDS) + 100 # Room for the markers
+        generated_val = await generate_cached(batched_prompt, max_output_tokens, is_valid=lambda answer_text: parse_batched_fields(answer_text) is not None)
+        if generated_val.startswith("ERROR:"):
+            return [(field_to_gen, generated_val) for field_to_gen in BATCHED_FIELDS]
+        parsed = parse_batched_fields(generated_val)
+        if parsed is not None:
+            return list(parsed.items())
+        events.put(("warning", f"Combined short-field answer for '{topic_input_val}' couldn't be parsed; generating those fields one by one."))
+        fallback_pieces = await asyncio.gather(*(guard_piece([f], generate_piece(f)) for f in BATCHED_FIELDS if f in topic_prompts))
+        return [piece for pieces in fallback_pieces for piece in pieces]
+
+    piece_jobs = [] # (fields the piece answers, coroutine)
+    batched_prompt = None
+    if settings['combine_short_fields'] and not marshaled_pieces: # Multi-topic requests take precedence
+        batched_prompt = build_topic_prompts(topic_row, settings['prompt_templates'], settings['prompt_context'], fields=[BATCHED_FIELDS_PROMPT_KEY]).get(BATCHED_FIELDS_PROMPT_KEY)
+    if batched_prompt:
+        piece_jobs.append((BATCHED_FIELDS, generate_batched_fields(batched_prompt)))
+        piece_jobs.extend(([f], generate_piece(f)) for f in topic_prompts if f not in BATCHED_FIELDS)
+    else:
+        piece_jobs.extend(([f], generate_piece(f)) for f in topic_prompts)
+
+    async def record_pieces(piece_fields, piece_job):
+        for field_to_gen, generated_val in await guard_piece(piece_fields, piece_job):
+            output_row[field_to_gen] = generated_val
+            events.put(("piece", topic_input_val, field_to_gen))
+
+    # gather (unlike as_completed) cancels the pieces still running when the topic is cancelled.
+    await asyncio.gather(*(record_pieces(piece_fields, piece_job) for piece_fields, piece_job in piece_jobs))
+    events.put(("topic", topic_input_val))
+    return output_row
+
+def plan_marshaled_fields(topic_rows, settings, generate_cached, events, job_tasks):
+    # Groups of up to `topics_per_request` topics share one request per short field. Returns, per topic,
+    # the marshaled_pieces mapping process_topic expects. main_text_html is long-form and never grouped.
+    # A group's request is only started when the first of its topics is being worked on, so it queues
+    # behind earlier topics instead of ahead of them; the started tasks are collected in `job_tasks`.
+    marshaled_pieces = [{} for _ in topic_rows]
+    topics_per_request = settings['topics_per_request']
+    if topics_per_request < 2:
+        return marshaled_pieces
+    group_prompts = {} # (field, group_idx) -> that group's prompts, in topic order
+    group_tasks = {} # (field, group_idx) -> task, once started
+
+    def start_group_task(group_key):
+        if group_key not in group_tasks:
+            group_tasks[group_key] = asyncio.ensure_future(generate_marshaled_field(group_key[0], group_prompts[group_key], generate_cached, events))
+            job_tasks.add(group_tasks[group_key])
+        return group_tasks[group_key]
+
+    all_topic_prompts = [build_topic_prompts(row, settings['prompt_templates'], settings['prompt_context']) for row in topic_rows]
+    for field_to_gen in BATCHED_FIELDS:
+        topic_idxs = [topic_idx for topic_idx, topic_prompts in enumerate(all_topic_prompts) if field_to_gen in topic_prompts]
+        for group_idx, group_start in enumerate(range(0, len(topic_idxs), topics_per_request)):
+            group = topic_idxs[group_start:group_start + topics_per_request]
+            if len(group) < 2:
+                continue # A lone topic is just a normal request
+            group_key = (field_to_gen, group_idx)
+            group_prompts[group_key] = [all_topic_prompts[topic_idx][field_to_gen] for topic_idx in group]
+            for position, topic_idx in enumerate(group):
+                marshaled_pieces[topic_idx][field_to_gen] = (functools.partial(start_group_task, group_key), position)
+    return marshaled_pieces
+
+async def process_all_topics(topic_rows, settings, events):
+    # A fixed pool of workers pulls topics off a queue, so only a few topics are open at once and
+    # earlier topics finish first instead of every topic starting together and finishing together.
+    job_tasks = set() # Shared tasks no single topic owns, cancelled if the job ends early
+    generate_cached = make_cached_generator(settings, events, job_tasks)
+    marshaled_pieces = plan_marshaled_fields(topic_rows, settings, generate_cached, events, job_tasks)
+    topic_queue = asyncio.Queue()
+    for topic_idx, row in enumerate(topic_rows):
+        topic_queue.put_nowait((topic_idx, row))
+    results_columns = empty_results_columns(len(topic_rows))
+
+    async def topic_worker():
+        while not topic_queue.empty():
+            topic_idx, row = topic_queue.get_nowait()
+            try:
+                output_row = await process_topic(row, settings, generate_cached, events, marshaled_pieces[topic_idx])
+            except Exception as e:
+                # Failed pieces are handled in process_topic; this catches a topic that couldn't start at all
+                # (e.g. its prompts couldn't be built), so it's reported in its own row instead of failing the run.
+                topic_input_val = row.get('topic_input', 'N/A')
+                events.put(("error", f"Topic '{topic_input_val}' failed: {e}"))
+                events.put(("topic", topic_input_val))
+                output_row = {"topic_input": topic_input_val, "primary_keyword": row.get('primary_keyword', ''), "secondary_keywords": row.get('secondary_keywords', '')}
+                output_row.update((field_to_gen, f"ERROR: Topic failed - {e}") for field_to_gen in GENERATION_FIELDS)
+            for column, value in output_row.items():
+                results_columns[column][topic_idx] = value
+
+    try:
+        await asyncio.gather(*(topic_worker() for _ in range(min(settings['max_concurrency'], len(topic_rows)))))
+    finally:
+        for task in job_tasks:
+            task.cancel() # No-op for finished tasks; stops billing for the rest after a Cancel
+    return results_columns
+
+# --- APPROVED LINK DETECTION & HTML AUDIT ---
+# Below this many articles, starting worker processes costs more than it saves.
+AUDIT_PROCESS_POOL_MIN_ROWS = 64
+AUDIT_CHUNKSIZE = 8
+
+@functools.lru_cache(maxsize=32)
+def parse_approved_urls(links_text):
+    # Extract the full URL part (before the description) from a "URL: Description" per-line list.
+    # Memoized per text and returned as a tuple, so the shared result can't be mutated by a caller.
+    approved_urls = []
+    for line in links_text.splitlines():
+        line_content = line.strip()
+        if line_content and ":" in line_content: # Ensure there's a colon
+            # Try to split by ": " first (colon followed by space)
+            parts_by_colon_space = line_content.split(": ", 1)
+            if len(parts_by_colon_space) == 2:
+                url_to_add = parts_by_colon_space[0].strip()
+            else:
+                # Fallback: if ": " not found or doesn't split cleanly, use rsplit on just ":"
+                url_to_add = line_content.rsplit(":", 1)[0].strip()
+            if url_to_add:
+                approved_urls.append(url_to_add)
+    return tuple(approved_urls)
+
+@functools.lru_cache(maxsize=32)
+def approved_url_keys(links_text):
+    # (url, match key) pairs: the trailing slash is stripped once per approved URL instead of once per article.
+    return tuple((url, url.rstrip("/")) for url in parse_approved_urls(links_text))
+
+@st.cache_resource(show_spinner=False)
+def get_link_matchers(approved_internal_links_text, approved_external_links_text):
+    # (internal, external) link matchers, built once per pair of link lists and reused by every run and session
+    # until a list changes. Shared, so treat them as read-only.
+    return (
+        build_link_matcher(approved_url_keys(approved_internal_links_text)),
+        build_link_matcher(approved_url_keys(approved_external_links_text)),
+    )
+
+def audit_articles(articles_html, link_matchers):
+    # HTML parsing is CPU-bound, so large runs fan out over processes (threads would serialise on the GIL).
+    if len(articles_html) >= AUDIT_PROCESS_POOL_MIN_ROWS and (os.cpu_count() or 1) > 1:
         try:
-            st.write(f"Configuring OpenAI with API key: {'*' * (len(OPENAI_API_KEY) - 4) + OPENAI_API_KEY[-4:] if OPENAI_API_KEY else 'Not Set'}")
-            client = openai.OpenAI(api_key=OPENAI_API_KEY)
-            for attempt in range(retries):
-                try:
-                    st.write(f"OpenAI API call attempt {attempt + 1}")
-                    response = client.chat.completions.create(
-                        model=model_name,
-                        messages=[{"role": "user", "content": prompt_text}],
-                        temperature=temperature
-                    )
-                    if response.choices and response.choices[0].message.content:
-                        generated_text = response.choices[0].message.content.strip()
-                        st.write(f"OpenAI response successful: {generated_text[:100]}...")
-                        return generated_text
-                    else:
-                        st.warning("OpenAI response empty.")
-                        st.write(f"OpenAI response empty. Attempt: {attempt+1}")
-                        if attempt < retries - 1: time.sleep(delay_seconds * (attempt + 1))
-                        else: return "ERROR: OpenAI response empty after retries."
-                except Exception as e:
-                    st.error(f"OpenAI API Error (Attempt {attempt+1}): {e}")
-                    st.write(f"OpenAI API Error (Attempt {attempt+1}): {e}")
-                    if attempt < retries - 1: time.sleep(delay_seconds * (attempt + 1))
-                    else: return f"ERROR: API call failed - {e}"
-            st.write("OpenAI max retries reached.")
-            return "ERROR: Max retries."
-        except Exception as e:
-            st.error(f"OpenAI Config/Setup Error: {e}")
-            st.write(f"OpenAI Config/Setup Error: {e}")
-            return f"ERROR: Setup - {e}"
+            # Spawned, not forked: forking the multi-threaded server (tornado, the generation loop, gRPC, SQLite I/O)
+            # can deadlock the child. html_audit is importable on its own, which is all spawn needs.
+            spawn_context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=spawn_context, initializer=init_audit_worker, initargs=(link_matchers,)) as pool:
+                return list(pool.map(audit_article, articles_html, chunksize=AUDIT_CHUNKSIZE))
+        except (OSError, NotImplementedError, RuntimeError, BrokenProcessPool) as e:
+            # e.g. serverless hosts without /dev/shm can't create process pools, or a spawned worker fails to start.
+            logger.warning("Process pool unavailable for the HTML audit, running in-process: %s", e)
+    return [audit_row(main_text_html, *link_matchers) for main_text_html in articles_html]
 
-    elif "claude" in model_name:
-        if not ANTHROPIC_API_KEY:
-            st.error("ANTHROPIC_API_KEY not configured.")
-            st.write("Error: ANTHROPIC_API_KEY not configured.")
-            return "ERROR: API Key missing."
+def add_found_links_columns(results_columns, link_matchers):
+    # Fill found_internal/external_links_in_html with the approved URLs linked from each main_text_html,
+    # and html_issues with any tags outside the prompt's whitelist. The matchers come from get_link_matchers.
+    audited = audit_articles(results_columns["main_text_html"], link_matchers)
+    audit_columns = ["found_internal_links_in_html", "found_external_links_in_html", "html_issues"]
+    for column, values in zip(audit_columns, zip(*audited)):
+        results_columns[column] = list(values)
+    return results_columns
+
+# --- PROVIDER BATCH API (OpenAI / Anthropic) ---
+# Batch jobs are ~50% cheaper than live calls but can take minutes to hours to finish.
+BATCH_POLL_INITIAL_DELAY_SECONDS = 5
+BATCH_POLL_MAX_DELAY_SECONDS = 60
+
+def batch_custom_id(topic_idx, field_to_gen):
+    # Anthropic only allows [a-zA-Z0-9_-] in custom IDs, so no colons here.
+    return f"{topic_idx}-{field_to_gen}"
+
+def submit_openai_batch(client, batch_prompts, model_name, temperature):
+    jsonl_lines = [
+        json.dumps({
+            "custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions",
+            "body": {"model": model_name, "messages": [{"role": "user", "content": prompt_text}], "temperature": temperature, "max_completion_tokens": max_output_tokens}
+        })
+        for custom_id, (prompt_text, max_output_tokens) in batch_prompts.items()
+    ]
+    batch_file = client.files.create(file=("batch_requests.jsonl", "\n".join(jsonl_lines).encode('utf-8')), purpose="batch")
+    return client.batches.create(input_file_id=batch_file.id, endpoint="/v1/chat/completions", completion_window="24h").id
+
+def check_openai_batch(client, batch_id):
+    # (finished, status text, {custom_id: text}); results are only fetched once the batch has finished.
+    batch = client.batches.retrieve(batch_id)
+    counts = batch.request_counts
+    status_text = f"OpenAI batch {batch.status}: {counts.completed if counts else 0} of {counts.total if counts else '?'} done"
+    if batch.status not in ("completed", "failed", "expired", "cancelled"):
+        return False, status_text, None
+    if batch.status != "completed" or not batch.output_file_id:
+        return True, status_text, {}
+
+    batch_results = {}
+    for line in client.files.content(batch.output_file_id).text.splitlines():
+        if not line.strip():
+            continue
+        result = json.loads(line)
         try:
-            st.write(f"Configuring Anthropic with API key: {'*' * (len(ANTHROPIC_API_KEY) - 4) + ANTHROPIC_API_KEY[-4:] if ANTHROPIC_API_KEY else 'Not Set'}")
-            client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
-            for attempt in range(retries):
-                try:
-                    st.write(f"Anthropic API call attempt {attempt + 1}")
-                    response = client.messages.create(
-                        model=model_name,
-                        max_tokens=2000,
-                        temperature=temperature,
-                        messages=[
-                            {
-                                "role": "user",
-                                "content": prompt_text
-                            }
-                        ]
-                    )
-                    if response.content and isinstance(response.content, list) and response.content[0].text:
-                        generated_text = response.content[0].text.strip()
-                        st.write(f"Anthropic response successful: {generated_text[:100]}...")
-                        return generated_text
-                    else:
-                        st.warning("Anthropic response empty or not in expected format.")
-                        st.write(f"Anthropic response empty. Attempt: {attempt+1}, Response: {response}")
-                        if attempt < retries - 1: time.sleep(delay_seconds * (attempt + 1))
-                        else: return "ERROR: Anthropic response empty/invalid after retries."
-                except Exception as e:
-                    st.error(f"Anthropic API Error (Attempt {attempt+1}): {e}")
-                    st.write(f"Anthropic API Error (Attempt {attempt+1}): {e}")
-                    if attempt < retries - 1: time.sleep(delay_seconds * (attempt + 1))
-                    else: return f"ERROR: API call failed - {e}"
-            st.write("Anthropic max retries reached.")
-            return "ERROR: Max retries."
-        except Exception as e:
-            st.error(f"Anthropic Config/Setup Error: {e}")
-            st.write(f"Anthropic Config/Setup Error: {e}")
-            return f"ERROR: Setup - {e}"
-    else:
-        st.error(f"Unsupported model provider for model: {model_name}")
-        st.write(f"Error: Unsupported model provider for model: {model_name}")
-        return "ERROR: Unsupported model provider."
+            choice = result["response"]["body"]["choices"][0]
+            if choice.get("finish_reason") == "length":
+                batch_results[result["custom_id"]] = "ERROR: Response cut off at the output token limit."
+                continue
+            batch_results[result["custom_id"]] = choice["message"]["content"].strip()
+        except (KeyError, IndexError, TypeError, AttributeError):
+            batch_results[result["custom_id"]] = f"ERROR: Batch request failed - {result.get('error')}"
+    return True, status_text, batch_results
+
+def submit_anthropic_batch(client, batch_prompts, model_name, temperature):
+    return client.messages.batches.create(requests=[
+        {
+            "custom_id": custom_id,
+            "params": {"model": model_name, "max_tokens": max_output_tokens, "temperature": temperature, "messages": [{"role": "user", "content": prompt_text}]}
+        }
+        for custom_id, (prompt_text, max_output_tokens) in batch_prompts.items()
+    ]).id
+
+def check_anthropic_batch(client, batch_id):
+    # (finished, status text, {custom_id: text}); results are only fetched once the batch has ended.
+    batch = client.messages.batches.retrieve(batch_id)
+    status_text = f"Anthropic batch {batch.processing_status}: {batch.request_counts.succeeded} succeeded, {batch.request_counts.processing} processing"
+    if batch.processing_status != "ended":
+        return False, status_text, None
+
+    batch_results = {}
+    for entry in client.messages.batches.results(batch_id):
+        if entry.result.type == "succeeded" and entry.result.message.stop_reason == "max_tokens":
+            batch_results[entry.custom_id] = "ERROR: Response cut off at the output token limit."
+        elif entry.result.type == "succeeded" and entry.result.message.content:
+            batch_results[entry.custom_id] = entry.result.message.content[0].text.strip()
+        else:
+            batch_results[entry.custom_id] = f"ERROR: Batch request {entry.result.type}"
+    return True, status_text, batch_results
+
+def check_provider_batch(model_name, client, batch_id):
+    return (check_openai_batch if "gpt" in model_name else check_anthropic_batch)(client, batch_id)
+
+# A submitted batch's custom_id -> LLM cache key map is stored in the batch manifest cache, so results can be
+# collected later by batch ID ("Check Batch Status") even if the page that submitted it was closed.
+BATCH_MANIFEST_TTL_SECONDS = 7 * 24 * 60 * 60
+
+def batch_request_key(model_name, cache_keys):
+    # Names a batch by what it asks for, so a rerun can find the batch that already holds the same requests.
+    cache_keys_hash = hashlib.blake2b("\n".join(sorted(cache_keys)).encode('utf-8')).hexdigest()
+    return f"requests|{model_name}|{cache_keys_hash}"
+
+def store_batch_results(llm_cache, cache_key_by_custom_id, batch_results):
+    # Successful batch answers go into the LLM cache, where any later run (live or batch) picks them up.
+    stored_count = 0
+    for custom_id, generated_val in batch_results.items():
+        if custom_id in cache_key_by_custom_id and not generated_val.startswith("ERROR:"):
+            llm_cache.set(cache_key_by_custom_id[custom_id], generated_val, expire=LLM_CACHE_TTL_SECONDS)
+            stored_count += 1
+    return stored_count
+
+def collect_batch_results(batch_id):
+    # Script-thread "Check Batch Status" action: (finished, message).
+    llm_cache = get_llm_cache()
+    manifest = get_batch_manifest_cache().get(batch_id)
+    if manifest is None:
+        return True, f"Batch `{batch_id}` is unknown here (submitted from another server, or older than 7 days)."
+    client = get_batch_client(manifest['model_name'])
+    if client is None:
+        return True, f"API key for '{manifest['model_name']}' not configured."
+    finished, status_text, batch_results = check_provider_batch(manifest['model_name'], client, batch_id)
+    if not finished:
+        return False, f"{status_text}. Check again later."
+    stored_count = store_batch_results(llm_cache, manifest['cache_keys'], batch_results)
+    get_batch_manifest_cache().delete(batch_request_key(manifest['model_name'], manifest['cache_keys'].values())) # No longer pending
+    return True, f"{status_text}. {stored_count} response(s) saved to the LLM cache. Run the same generation again to build the results table from them instantly."
+
+def check_earlier_batch(settings, request_key):
+    # A batch already submitted for exactly these requests, e.g. one whose wait was cancelled:
+    # (batch_id or None, finished, status text, {cache key: answer}). A finished one has its answers saved to
+    # the LLM cache and is forgotten, so only requests it didn't answer are submitted again.
+    manifest_cache = settings['batch_manifest_cache']
+    batch_id = manifest_cache.get(request_key)
+    if batch_id is None:
+        return None, True, "", {}
+    finished, status_text, batch_results = check_provider_batch(settings['model_name'], settings['batch_client'], batch_id)
+    if not finished:
+        return batch_id, False, status_text, {}
+    manifest = manifest_cache.get(batch_id) or {'cache_keys': {}}
+    store_batch_results(settings['llm_cache'], manifest['cache_keys'], batch_results)
+    manifest_cache.delete(request_key)
+    answers = {
+        manifest['cache_keys'][custom_id]: generated_val for custom_id, generated_val in batch_results.items()
+        if custom_id in manifest['cache_keys'] and not generated_val.startswith("ERROR:")
+    }
+    return batch_id, True, status_text, answers
+
+def collect_batch_prompts(topic_rows, settings, events):
+    # Blocking part of a batch run: fills the results columns from the LLM cache and returns
+    # (results_columns, batch_prompts, batch_targets) for the prompts still to be sent.
+    model_name, temperature = settings['model_name'], settings['llm_temperature']
+    llm_cache = settings['llm_cache']
+    results_columns = empty_results_columns(len(topic_rows))
+    batch_prompts = {} # custom_id -> (prompt, max output tokens), one per unique prompt
+    batch_targets = {} # custom_id -> (cache key, [(topic_idx, field), ...])
+    custom_id_by_cache_key = {}
+    for topic_idx, topic_row in enumerate(topic_rows):
+        topic_input_val = results_columns["topic_input"][topic_idx] = topic_row.get('topic_input', 'N/A')
+        results_columns["primary_keyword"][topic_idx] = topic_row.get('primary_keyword', '')
+        results_columns["secondary_keywords"][topic_idx] = topic_row.get('secondary_keywords', '')
+        topic_prompts = build_topic_prompts(topic_row, settings['prompt_templates'], settings['prompt_context'])
+        for field_to_gen in GENERATION_FIELDS:
+            if field_to_gen not in topic_prompts:
+                results_columns[field_to_gen][topic_idx] = "ERROR: No Prompt"
+                continue
+            cache_key = llm_cache_key(topic_prompts[field_to_gen], model_name, temperature)
+            cached_val = llm_cache.get(cache_key)
+            if cached_val is not None:
+                results_columns[field_to_gen][topic_idx] = cached_val
+                events.put(("piece", topic_input_val, field_to_gen))
+                continue
+            # Duplicate prompts ride along on the first request's custom_id instead of being billed again.
+            custom_id = custom_id_by_cache_key.get(cache_key)
+            if custom_id is None:
+                custom_id = custom_id_by_cache_key[cache_key] = batch_custom_id(topic_idx, field_to_gen)
+                batch_prompts[custom_id] = (topic_prompts[field_to_gen], FIELD_MAX_OUTPUT_TOKENS.get(field_to_gen, DEFAULT_MAX_OUTPUT_TOKENS))
+                batch_targets[custom_id] = (cache_key, [])
+            batch_targets[custom_id][1].append((topic_idx, field_to_gen))
+    return results_columns, batch_prompts, batch_targets
+
+async def run_provider_batch(topic_rows, settings, events):
+    # Same results columns as process_all_topics, but uncached prompts go through the provider's Batch API.
+    # Only the blocking calls run on the default thread pool; the wait between polls is an asyncio.sleep, so a
+    # waiting batch holds no thread (cache lookups of live runs share that pool) and Cancel stops the polling.
+    model_name, temperature = settings['model_name'], settings['llm_temperature']
+    llm_cache = settings['llm_cache']
+    results_columns, batch_prompts, batch_targets = await asyncio.to_thread(collect_batch_prompts, topic_rows, settings, events)
+
+    if batch_prompts:
+        # Never submit (and bill) the same requests twice while an earlier batch for them is still running.
+        request_key = batch_request_key(model_name, [cache_key for cache_key, _ in batch_targets.values()])
+        earlier_batch_id, earlier_finished, earlier_status, earlier_answers = await asyncio.to_thread(check_earlier_batch, settings, request_key)
+        if not earlier_finished:
+            events.put(("batch_submitted", earlier_batch_id))
+            raise RuntimeError(f"These requests are already in batch `{earlier_batch_id}` ({earlier_status}). Collect its results with \"🔎 Check Batch Status\" instead of submitting them again.")
+        if earlier_batch_id is not None:
+            events.put(("log", f"Collected earlier batch `{earlier_batch_id}` ({earlier_status})."))
+        for custom_id, (cache_key, targets) in list(batch_targets.items()):
+            if cache_key in earlier_answers:
+                for topic_idx, field_to_gen in targets:
+                    results_columns[field_to_gen][topic_idx] = earlier_answers[cache_key]
+                    events.put(("piece", results_columns["topic_input"][topic_idx], field_to_gen))
+                del batch_targets[custom_id], batch_prompts[custom_id]
+
+    if batch_prompts:
+        client = settings['batch_client']
+        manifest_cache = settings['batch_manifest_cache']
+        submit_batch = submit_openai_batch if "gpt" in model_name else submit_anthropic_batch
+        batch_id = await asyncio.to_thread(submit_batch, client, batch_prompts, model_name, temperature)
+        cache_key_by_custom_id = {custom_id: cache_key for custom_id, (cache_key, _) in batch_targets.items()}
+        await asyncio.to_thread(manifest_cache.set, batch_id, {'model_name': model_name, 'cache_keys': cache_key_by_custom_id}, expire=BATCH_MANIFEST_TTL_SECONDS)
+        await asyncio.to_thread(manifest_cache.set, batch_request_key(model_name, cache_key_by_custom_id.values()), batch_id, expire=BATCH_MANIFEST_TTL_SECONDS)
+        events.put(("batch_submitted", batch_id))
+        events.put(("log", f"Submitted batch `{batch_id}` with {len(batch_prompts)} request(s)."))
+
+        delay = BATCH_POLL_INITIAL_DELAY_SECONDS
+        while True:
+            finished, status_text, batch_results = await asyncio.to_thread(check_provider_batch, model_name, client, batch_id)
+            if finished:
+                break
+            events.put(("status", f"{status_text}..."))
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, BATCH_POLL_MAX_DELAY_SECONDS)
+        await asyncio.to_thread(store_batch_results, llm_cache, cache_key_by_custom_id, batch_results)
+        for custom_id, (cache_key, targets) in batch_targets.items():
+            generated_val = batch_results.get(custom_id, f"ERROR: Missing from batch output ({status_text})")
+            for topic_idx, field_to_gen in targets:
+                results_columns[field_to_gen][topic_idx] = generated_val
+                events.put(("piece", results_columns["topic_input"][topic_idx], field_to_gen))
+    return results_columns
+
+# --- BACKGROUND GENERATION JOB ---
+@st.cache_resource
+def get_generation_loop():
+    # One long-lived event loop on a daemon thread runs every generation job, so the script thread never waits on API calls.
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="llm-generation-loop", daemon=True).start()
+    return loop
+
+RESULTS_CSV_CHUNKSIZE = 1000
+
+def results_to_csv_bytes(results_df):
+    # Encoded straight into a bytes buffer in row chunks: no full-size intermediate str to .encode() afterwards.
+    csv_buffer = io.BytesIO()
+    results_df.to_csv(csv_buffer, index=False, encoding='utf-8', chunksize=RESULTS_CSV_CHUNKSIZE)
+    return csv_buffer.getvalue()
+
+async def run_generation_job(topic_rows, settings, events):
+    # Must not touch st.* or st.session_state: everything it needs is in `settings`, and all output goes to `events`.
+    try:
+        if settings['use_batch_api']:
+            results_columns = await run_provider_batch(topic_rows, settings, events)
+        else:
+            results_columns = await process_all_topics(topic_rows, settings, events)
+        # Off the event loop, so the live preview and Cancel stay responsive during a long audit.
+        await asyncio.to_thread(add_found_links_columns, results_columns, settings['link_matchers'])
+        # Built once from the finished columns: no per-row dicts and no schema inference over records.
+        results_df = pd.DataFrame(results_columns, columns=CSV_COLUMN_HEADERS, copy=False)
+        # Encoded once here, so reruns neither re-encode nor re-hash the table for a cache lookup.
+        results_csv = await asyncio.to_thread(results_to_csv_bytes, results_df)
+        events.put(("done", results_df, results_csv))
+    except Exception as e:
+        events.put(("failed", f"{e}"))
+
+def start_generation_job(topic_rows, settings):
+    events = queue.Queue()
+    future = asyncio.run_coroutine_threadsafe(run_generation_job(topic_rows, settings, events), get_generation_loop())
+    st.session_state.generation_job = {
+        'events': events, 'future': future, 'state': "running",
+        'model_name': settings['model_name'], 'topic_count': len(topic_rows),
+        'total_pieces': len(topic_rows) * len(GENERATION_FIELDS), 'completed_pieces': 0,
+        'label': f"Generating {len(topic_rows) * len(GENERATION_FIELDS)} content pieces...",
+        'log': [], 'preview': None, 'results_df': None, 'results_csv': None,
+        'link_matchers': settings['link_matchers'],
+        'batch_id': None,
+    }
+
+def drain_generation_events(job):
+    # Apply everything the background job has reported since the last poll.
+    while True:
+        try:
+            event = job['events'].get_nowait()
+        except queue.Empty:
+            return
+        kind = event[0]
+        if kind == "piece":
+            job['completed_pieces'] += 1 # Counted only; the log is written per topic
+        elif kind == "topic":
+            job['log'].append(f"✅ Finished **{event[1]}**")
+        elif kind == "status":
+            job['label'] = event[1]
+        elif kind == "batch_submitted":
+            job['batch_id'] = event[1]
+            st.session_state.last_batch_id = event[1] # Prefills "Check Batch Status", e.g. after cancelling the wait
+        elif kind == "preview":
+            job['preview'] = (event[1], event[2], event[3])
+        elif kind == "log":
+            job['log'].append(event[1])
+        elif kind == "warning":
+            job['log'].append(f"⚠️ {event[1]}")
+        elif kind == "error":
+            job['log'].append(f"❌ {event[1]}")
+        elif kind == "done":
+            job['results_df'], job['results_csv'] = event[1], event[2]
+            job['state'] = "complete"
+        elif kind == "failed":
+            job['log'].append(f"❌ Generation failed: {event[1]}")
+            job['state'] = "error"
+
+# Each poll re-sends everything the fragment draws, so it draws a bounded amount: the end of the article being
+# previewed and the most recent log lines as one markdown block.
+PREVIEW_TAIL_CHARS = 4000
+PROGRESS_LOG_LINES = 50
+
+@st.fragment(run_every=0.5)
+def render_generation_progress():
+    # Polls the running job twice a second; only this fragment reruns while generation is in flight.
+    job = st.session_state.generation_job
+    drain_generation_events(job)
+    if job['state'] != "running":
+        st.rerun() # Full rerun renders the final results and stops polling
+    st.progress(min(job['completed_pieces'] / max(job['total_pieces'], 1), 1.0))
+    st.info(f"🔄 {job['label']} ({job['completed_pieces']} of {job['total_pieces']} done)")
+    if job['batch_id']:
+        st.caption(f"📦 Batch ID `{job['batch_id']}`: if you close this page, collect the results later with \"Check Batch Status\".")
+    if job['preview']:
+        preview_label, preview_text, preview_linked_keys = job['preview']
+        with st.expander(f"👀 Live preview: {preview_label}", expanded=True):
+            internal_link_matcher, external_link_matcher = job['link_matchers']
+            found_internal = sum(url_key in internal_link_matcher for url_key in preview_linked_keys)
+            found_external = sum(url_key in external_link_matcher for url_key in preview_linked_keys)
+            st.caption(f"🔗 Approved links so far: {found_internal} internal · {found_external} external · {len(preview_linked_keys)} link(s) in total")
+            if len(preview_text) > PREVIEW_TAIL_CHARS:
+                preview_text = "…" + preview_text[-PREVIEW_TAIL_CHARS:]
+            st.text(preview_text)
+    with st.status("Generation log", expanded=False):
+        if job['log']:
+            st.markdown("  \n".join(job['log'][-PROGRESS_LOG_LINES:]))
+    if st.button("🛑 Cancel Generation", key="cancel_generation_button"):
+        job['future'].cancel()
+        job['state'] = "cancelled"
+        st.rerun()
 
 # --- UI LAYOUT ---
 st.set_page_config(layout="wide", page_title="AI SEO Content Engine - Full Control")
@@ -300,109 +1171,75 @@ if not GEMINI_API_KEY:
 tab_main_app, tab_instructions = st.tabs(["⚙️ Main Application", "📖 Instructions & Help"])
 
 # --- INSTRUCTIONS TAB CONTENT ---
+# Streamlit renders every tab on every rerun, so the help text is read from disk once and cached.
+INSTRUCTIONS_MD_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "instructions.md")
+
+@st.cache_data(show_spinner=False)
+def load_instructions_md():
+    with open(INSTRUCTIONS_MD_PATH, encoding="utf-8") as f:
+        return f.read()
+
 with tab_instructions:
     st.header("📖 How to Use the AI SEO Content Engine")
-    st.markdown("""
-    Welcome, Bastian! This tool is designed to give you full control over generating SEO-optimized content using AI.
-    Here's a breakdown of how to use it effectively:
-    """)
-
-    st.subheader("1. Initial Setup (First Time & Key Management)")
-    st.markdown("""
-    - **API Keys:** This application requires API Keys for the selected LLM provider.
-        - **Gemini:** `GEMINI_API_KEY`
-        - **OpenAI:** `OPENAI_API_KEY`
-        - **Anthropic:** `ANTHROPIC_API_KEY`
-    - **Local Use:** Ensure you have a `.streamlit/secrets.toml` file in the same directory as `app.py` with your keys, e.g.:
-      ```toml
-      GEMINI_API_KEY = "YOUR_GEMINI_KEY"
-      OPENAI_API_KEY = "YOUR_OPENAI_KEY"
-      ANTHROPIC_API_KEY = "YOUR_ANTHROPIC_KEY"
-      ```
-    - **Deployed (e.g., Vercel):** The API keys must be set as environment variables (e.g., `GEMINI_API_KEY`, `OPENAI_API_KEY`, `ANTHROPIC_API_KEY`) on the hosting platform.
-    - **If an API key for the selected model provider is missing, the app won't be able to generate content with that provider.**
-    """)
-
-    st.subheader("2. Configuration Management (Sidebar 🛠️)")
-    st.markdown("""
-    - **Save Configuration:**
-        - After you've set up your prompts, link lists, topics, and other settings perfectly for a specific task (e.g., "/hire/" cluster), give it a name in "Configuration Name (for saving)" and click "💾 Save Current Configuration."
-        - This will trigger a **download of a JSON file** to your computer. Keep this file safe!
-        - The "Current Config" name at the top of the page will update.
-    - **Load Configuration:**
-        - To restore a previously saved setup, use the "📂 Load Configuration from JSON File" uploader to select your saved JSON file.
-        - The app will populate all fields with the loaded settings. You might see the page refresh.
-    - **Why this is important:** This allows you to have different "setups" for different content types without re-entering everything.
-    """)
-
-    st.subheader("3. Global Settings (Sidebar 🛠️)")
-    st.markdown("""
-    - **Select Model:** Choose the AI model from the dropdown. This list includes models from Gemini, OpenAI, and Anthropic.
-    - **LLM Temperature:** Controls AI creativity.
-        - `0.0 - 0.3`: More factual, predictable, less creative. Good for constrained tasks.
-        - `0.4 - 0.7`: Balanced (default is `0.6`).
-        - `0.8 - 1.0`: More creative, diverse, but higher risk of unexpected or off-topic output.
-    """)
-
-    st.subheader("4. Inputs & Contextual Data (Main Area - Left Column 📝)")
-    st.markdown("""
-    - **Topics & Keywords:**
-        - **Upload CSV:** The best way for multiple topics. Create a CSV file with columns: `topic_input`, `primary_keyword`, `secondary_keywords`. (Secondary keywords should be a comma-separated list in their cell).
-        - **Data Editor:** After uploading or if using defaults, you can directly edit the topics, primary keywords, and secondary keywords in the table. You can also add or delete rows.
-    - **Approved Link Lists:**
-        - **CRITICAL for link quality!** Provide lists of URLs the AI is *allowed* to use.
-        - Format: `https://full.url/path: Brief description of the page` (one entry per line).
-        - **Important for Parsing:** To ensure links are identified correctly, please **avoid using colons (`:`) within the *Brief description* part of each line.** The system uses the colon to separate the URL from its description.
-    - **Core Contextual Data:**
-        - **Brand Guidelines:** Tell the AI about Workstream's voice, tone, audience.
-        - **SEO Best Practices:** Remind the AI of key SEO principles.
-    - **Link Generation Targets:** Specify how many internal/external links the `main_text_html` prompt should aim for.
-    """)
-
-    st.subheader("5. Prompt Engineering Zone (Main Area - Right Column 🔧)")
-    st.markdown("""
-    - This is where you **directly instruct the AI.** Each content piece (Title, Meta, Main Text, etc.) has its own prompt.
-    - **Click on an expander** (e.g., "Edit Prompt for: `main_text_html`") to view and edit the prompt.
-    - **Placeholders:** Prompts use `[PLACEHOLDERS]` (e.g., `[TOPIC_INPUT]`, `[PRIMARY_KEYWORD]`, `[APPROVED_INTERNAL_LINKS_TEXT]`). The system automatically fills these with the relevant data from your inputs before sending to the AI. **Do not remove or change the square brackets of these placeholders.**
-    - **Editing Prompts:**
-        - Be specific and clear in your instructions.
-        - If the AI makes mistakes (e.g., markdown fences ` ```html ` around HTML output), modify the prompt to explicitly forbid it (e.g., "Output ONLY raw HTML. DO NOT use markdown fences.").
-        - Iterate! Small changes can have big impacts.
-    - **Your edits to prompts are part of the "Current Configuration"** and will be saved if you use "Save Current Configuration."
-    """)
-
-    st.subheader("6. Execute Generation (Bottom Buttons 🚀)")
-    st.markdown("""
-    - **✨ Generate Content for ALL Topics ✨:** Processes all topics currently loaded in the "Topics & Keywords" editor/CSV.
-    - **🧪 Test with FIRST Topic Only:** Ideal for quickly testing prompt changes. Processes only the first topic in the list.
-    - **Progress:** A progress bar and status messages will appear.
-    """)
-
-    st.subheader("7. Review Output & Download 📊")
-    st.markdown("""
-    - Generated content appears in a table. Review it carefully.
-        - **Check Links:** Are `found_internal_links_in_html` and `found_external_links_in_html` showing the correct URLs from your approved lists? Manually verify the actual links in the `main_text_html`.
-        - **Check Formatting:** Is the HTML clean? (e.g., no unwanted markdown).
-        - **Check Quality:** Readability, tone, accuracy, SEO.
-    - **📥 Download All Results as CSV:** Saves the generated content to a CSV file for HubSpot import or further review.
-    """)
-
-    st.subheader("General Workflow for Refinement:")
-    st.markdown("""
-    1. **Load a base configuration** or start with defaults.
-    2. **Prepare your Topics & Keywords** (upload CSV or edit in table).
-    3. **Verify Link Lists & Contextual Data.**
-    4. **Tweak a specific prompt** in the "Prompt Engineering Zone."
-    5. Use **"🧪 Test with FIRST Topic Only"** to see the impact of your prompt change.
-    6. **Review the single output.** If good, proceed. If not, go back to step 4.
-    7. Once happy with individual prompt elements, run **"✨ Generate Content for ALL Topics ✨"** for a larger batch.
-    8. **Thoroughly review the full output CSV.**
-    9. **Save your improved configuration** often!
-    """)
+    st.markdown(load_instructions_md())
     st.markdown("---")
     st.success("Happy Content Generating!")
 
 
+# --- UI FRAGMENTS ---
+# Interacting with a fragment reruns only that fragment, so editing topics doesn't re-render the
+# prompt editors (and vice versa). Both only write to st.session_state, which generation reads on click.
+@st.fragment
+def render_topics_editor():
+    uploaded_topics_csv = st.file_uploader("Upload Topics CSV", type="csv", key="topics_csv_uploader_main_tab") # Unique key
+    if uploaded_topics_csv is not None:
+        try:
+            st.session_state.topics_df = parse_topics_csv(uploaded_topics_csv.getvalue())
+            st.session_state.uploaded_topics_filename = uploaded_topics_csv.name
+            st.success(f"Loaded '{uploaded_topics_csv.name}' successfully into editor below.")
+        except Exception as e:
+            st.error(f"Error processing uploaded CSV: {e}")
+            
+    st.caption(f"Editing data for: {st.session_state.uploaded_topics_filename or 'current session / defaults'}")
+    if not st.session_state.topics_df.empty or st.session_state.uploaded_topics_filename: # Show editor if df has data or a file was just uploaded
+        edited_df = st.data_editor(
+            st.session_state.topics_df,
+            num_rows="dynamic", 
+            key="topics_data_editor_main_tab", # Unique key
+            use_container_width=True,
+            column_config={ # Optional: Make columns more user-friendly
+                "topic_input": st.column_config.TextColumn("Topic / Page Slug Target", required=True),
+                "primary_keyword": st.column_config.TextColumn("Primary Keyword"),
+                "secondary_keywords": st.column_config.TextColumn("Secondary Keywords (comma-sep)"),
+            }
+        )
+        # The editor's own state records pending edits, so an unedited table is detected without comparing every cell.
+        editor_changes = st.session_state.get("topics_data_editor_main_tab") or {}
+        if edited_df is not st.session_state.topics_df and any(editor_changes.get(change) for change in ("edited_rows", "added_rows", "deleted_rows")):
+            st.session_state.topics_df = edited_df
+    else:
+        st.info("No topics loaded. Upload a CSV above to populate the editor, or a default set may load.")
+
+@st.fragment
+def render_prompt_editor():
+    # Edits are staged in a form so typing doesn't rerun the app; they take effect on "Apply Prompt Changes".
+    with st.form("prompt_editor_form", border=False):
+        edited_prompts = {}
+        for prompt_key_iter, default_prompt_text_iter in PROMPT_TEMPLATES_DEFAULTS.items():
+            current_prompt_val_iter = st.session_state.editable_prompts.get(prompt_key_iter, default_prompt_text_iter)
+            with st.expander(f"Edit Prompt for: `{prompt_key_iter}`", expanded=(prompt_key_iter == "main_text_html")):
+                edited_prompts[prompt_key_iter] = st.text_area(
+                    f"Instructions for `{prompt_key_iter}`:",
+                    value=current_prompt_val_iter,
+                    height=250,
+                    key=f"prompt_editor_area_main_tab_{prompt_key_iter}" # Unique key
+                )
+        if st.form_submit_button("💾 Apply Prompt Changes", type="primary"):
+            # Copy on write: the default prompts dict is shared across sessions.
+            st.session_state.editable_prompts = {**st.session_state.editable_prompts, **edited_prompts}
+            st.success("Prompt changes applied.")
+
+
 # --- MAIN APPLICATION TAB CONTENT ---
 with tab_main_app:
     # --- Sidebar for Configuration Management & Global Settings (Copied from previous version) ---
@@ -416,10 +1253,10 @@ with tab_main_app:
         if st.button("💾 Save Current Configuration", key="save_config_button"):
             config_to_save = get_current_config_dict()
             try:
-                json_str = json.dumps(config_to_save, indent=2)
+                json_bytes = orjson.dumps(config_to_save, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
                 st.download_button(
                     label="📥 Download Config JSON",
-                    data=json_str,
+                    data=json_bytes, # Bytes go straight to the browser without re-encoding
                     file_name=f"{config_name}.json",
                     mime="application/json",
                     key="download_config_json_button" # Unique key
@@ -437,7 +1274,7 @@ with tab_main_app:
 
         if uploaded_config_file is not None and not st.session_state.config_just_processed:
             try:
-                config_data = json.load(uploaded_config_file)
+                config_data = orjson.loads(uploaded_config_file.getvalue())
                 load_config_from_dict(config_data) # This function now updates session_state
                 st.session_state.active_config_name = uploaded_config_file.name
                 st.success(f"Configuration '{uploaded_config_file.name}' loaded! UI elements reflecting new settings.")
@@ -452,17 +1289,50 @@ with tab_main_app:
             st.session_state.config_just_processed = False
         
         st.markdown("---")
-        # Directly update session state from widget
-        st.session_state.model_name = st.selectbox(
-            "Select Model:", # Changed label
-            ["gemini-2.5-pro-exp-03-25", "gpt-4.1", "claude-3-7-sonnet-20250219"], # Updated model list
-            index=["gemini-2.5-pro-exp-03-25", "gpt-4.1", "claude-3-7-sonnet-20250219"].index(st.session_state.model_name if st.session_state.model_name in ["gemini-2.5-pro-exp-03-25", "gpt-4.1", "claude-3-7-sonnet-20250219"] else "gemini-2.5-pro-exp-03-25"), # Updated index logic
-            key="model_selector"
-        )
-        st.session_state.llm_temperature = st.slider(
-            "LLM Temperature (Creativity):", 0.0, 1.0, st.session_state.llm_temperature, 0.05,
-            help="Lower = more focused. Higher = more creative.", key="temp_slider"
-        )
+        # Settings are staged in a form: moving a slider no longer reruns the app, only "Apply Settings" does.
+        with st.form("settings_form"):
+            model_choice = st.selectbox(
+                "Select Model:", # Changed label
+                ["gemini-2.5-pro-exp-03-25", "gpt-4.1", "claude-3-7-sonnet-20250219"], # Updated model list
+                index=["gemini-2.5-pro-exp-03-25", "gpt-4.1", "claude-3-7-sonnet-20250219"].index(st.session_state.model_name if st.session_state.model_name in ["gemini-2.5-pro-exp-03-25", "gpt-4.1", "claude-3-7-sonnet-20250219"] else "gemini-2.5-pro-exp-03-25"), # Updated index logic
+                key="model_selector"
+            )
+            temperature_choice = st.slider(
+                "LLM Temperature (Creativity):", 0.0, 1.0, st.session_state.llm_temperature, 0.05,
+                help="Lower = more focused. Higher = more creative.", key="temp_slider"
+            )
+            concurrency_choice = st.slider(
+                "Max Concurrent API Requests:", 1, 32, st.session_state.max_concurrency, 1,
+                help="How many LLM calls run at the same time. Lower this if you hit provider rate limits.", key="concurrency_slider"
+            )
+            combine_choice = st.checkbox(
+                "Combine short fields into one call", value=st.session_state.combine_short_fields,
+                help="Generates title, meta description, H1, subtitle and alt text with the `batched_fields` prompt: one request per topic instead of five. Live runs only.",
+                key="combine_short_fields_checkbox"
+            )
+            topics_per_request_choice = st.number_input(
+                "Topics per Short-Field Request:", 1, 16, st.session_state.topics_per_request, 1,
+                help="Above 1, the short fields (title, meta description, H1, subtitle, alt text) for up to this many topics are requested together: fewer requests on large runs. 8 or less keeps quality steady. Live runs only.",
+                key="topics_per_request_input"
+            )
+            rpm_choice = st.number_input(
+                "Max Requests per Minute (0 = unlimited):", 0, 10000, st.session_state.requests_per_minute, 10,
+                help="Spaces out live LLM calls to stay under your provider's RPM limit. Cached responses don't count.", key="rpm_input"
+            )
+            if st.form_submit_button("✅ Apply Settings", use_container_width=True):
+                st.session_state.model_name = model_choice
+                st.session_state.llm_temperature = temperature_choice
+                st.session_state.max_concurrency = concurrency_choice
+                st.session_state.requests_per_minute = int(rpm_choice)
+                st.session_state.combine_short_fields = combine_choice
+                st.session_state.topics_per_request = int(topics_per_request_choice)
+        rpm_text = f"{st.session_state.requests_per_minute}/min" if st.session_state.requests_per_minute else "no RPM limit"
+        st.caption(f"Active: `{st.session_state.model_name}` · temperature {st.session_state.llm_temperature} · {st.session_state.max_concurrency} concurrent · {rpm_text}")
+        st.markdown("---")
+        if isinstance(get_llm_cache(), DisabledCache):
+            st.warning(f"LLM response cache unavailable (can't write to `{LLM_CACHE_DIR}`); responses won't be reused. Set LLM_CACHE_DIR to a writable directory.")
+        else:
+            st.caption(f"LLM response cache: {len(get_llm_cache())} stored response(s).")
         st.markdown("---")
         st.info("Remember to save your configuration if you make significant changes!")
 
@@ -477,35 +1347,7 @@ with tab_main_app:
         st.subheader("🎯 Topics & Keywords")
         st.markdown("Upload a CSV file (`topic_input`, `primary_keyword`, `secondary_keywords`) or edit below.")
         
-        uploaded_topics_csv = st.file_uploader("Upload Topics CSV", type="csv", key="topics_csv_uploader_main_tab") # Unique key
-        if uploaded_topics_csv is not None:
-            try:
-                df = pd.read_csv(uploaded_topics_csv)
-                for col in ['topic_input', 'primary_keyword', 'secondary_keywords']:
-                    if col not in df.columns: df[col] = "" 
-                st.session_state.topics_df = df[['topic_input', 'primary_keyword', 'secondary_keywords']]
-                st.session_state.uploaded_topics_filename = uploaded_topics_csv.name
-                st.success(f"Loaded '{uploaded_topics_csv.name}' successfully into editor below.")
-            except Exception as e:
-                st.error(f"Error processing uploaded CSV: {e}")
-                
-        st.caption(f"Editing data for: {st.session_state.uploaded_topics_filename or 'current session / defaults'}")
-        if not st.session_state.topics_df.empty or st.session_state.uploaded_topics_filename: # Show editor if df has data or a file was just uploaded
-            edited_df = st.data_editor(
-                st.session_state.topics_df,
-                num_rows="dynamic", 
-                key="topics_data_editor_main_tab", # Unique key
-                use_container_width=True,
-                column_config={ # Optional: Make columns more user-friendly
-                    "topic_input": st.column_config.TextColumn("Topic / Page Slug Target", required=True),
-                    "primary_keyword": st.column_config.TextColumn("Primary Keyword"),
-                    "secondary_keywords": st.column_config.TextColumn("Secondary Keywords (comma-sep)"),
-                }
-            )
-            if not edited_df.equals(st.session_state.topics_df):
-                 st.session_state.topics_df = edited_df
-        else:
-            st.info("No topics loaded. Upload a CSV above to populate the editor, or a default set may load.")
+        render_topics_editor()
 
 
         st.subheader("🔗 Approved Link Lists")
@@ -514,167 +1356,140 @@ with tab_main_app:
             "Example: `https://workstream.us/product: Our Product Page`\n"
             "**Important:** For best results, please avoid using colons (`:`) within the *Description* part of the line."
         )
-        st.session_state.approved_internal_links = st.text_area("Workstream Internal URLs (URL: Description per line):", value=st.session_state.approved_internal_links, height=120, key="internal_links_text_area")
-        st.session_state.approved_external_links = st.text_area("Authoritative External URLs (URL: Description per line):", value=st.session_state.approved_external_links, height=100, key="external_links_text_area")
+        # Widgets keyed by their session_state entry: Streamlit keeps the value in sync, no write-back needed.
+        # (Config loading sets these keys in the sidebar, which runs before the widgets are created.)
+        st.text_area("Workstream Internal URLs (URL: Description per line):", height=120, key="approved_internal_links")
+        st.text_area("Authoritative External URLs (URL: Description per line):", height=100, key="approved_external_links")
 
         st.subheader("📜 Core Contextual Data")
-        st.session_state.brand_guidelines = st.text_area("Workstream Brand Guidelines:", value=st.session_state.brand_guidelines, height=120, key="brand_guidelines_text_area")
-        st.session_state.seo_summary = st.text_area("SEO Best Practices Summary:", value=st.session_state.seo_summary, height=120, key="seo_summary_text_area")
+        st.text_area("Workstream Brand Guidelines:", height=120, key="brand_guidelines")
+        st.text_area("SEO Best Practices Summary:", height=120, key="seo_summary")
 
         st.subheader("⛓️ Link Generation Targets")
-        st.session_state.target_internal_links = st.number_input("Target # Internal Links:", 0, 30, st.session_state.target_internal_links, key="target_int_links_input")
-        st.session_state.target_external_links = st.number_input("Target # External Links:", 0, 15, st.session_state.target_external_links, key="target_ext_links_input")
+        st.number_input("Target # Internal Links:", 0, 30, key="target_internal_links")
+        st.number_input("Target # External Links:", 0, 15, key="target_external_links")
 
     with col_prompts_editor:
         st.header("🔧 Prompt Engineering Zone")
         st.warning("These prompts are the AI's direct instructions. Edit carefully! Note `[PLACEHOLDERS]` which are filled by the system.")
         
-        for prompt_key_iter, default_prompt_text_iter in PROMPT_TEMPLATES_DEFAULTS.items():
-            current_prompt_val_iter = st.session_state.editable_prompts.get(prompt_key_iter, default_prompt_text_iter)
-            with st.expander(f"Edit Prompt for: `{prompt_key_iter}`", expanded=(prompt_key_iter == "main_text_html")):
-                edited_prompt_iter = st.text_area(
-                    f"Instructions for `{prompt_key_iter}`:",
-                    value=current_prompt_val_iter,
-                    height=250,
-                    key=f"prompt_editor_area_main_tab_{prompt_key_iter}" # Unique key
-                )
-                if edited_prompt_iter != st.session_state.editable_prompts.get(prompt_key_iter):
-                    st.session_state.editable_prompts[prompt_key_iter] = edited_prompt_iter
+        render_prompt_editor()
 
     # --- GENERATION BUTTONS & OUTPUT AREA ---
     st.markdown("---")
     st.header("🚀 Execute Generation & Review Output")
 
+    generation_running = st.session_state.get('generation_job', {}).get('state') == "running"
     col_run_all, col_run_single = st.columns(2)
     with col_run_all:
-        if st.button("✨ Generate Content for ALL Topics ✨", type="primary", use_container_width=True, help="Processes all topics from the editor/uploaded CSV.", key="gen_all_button"):
+        if st.button("✨ Generate Content for ALL Topics ✨", type="primary", use_container_width=True, help="Processes all topics from the editor/uploaded CSV.", key="gen_all_button", disabled=generation_running):
             st.session_state.run_mode = "all"
             st.session_state.trigger_generation = True 
+        st.session_state.use_batch_api = st.checkbox(
+            "📦 Submit as Batch Job (OpenAI/Anthropic only: ~50% cheaper, can take minutes to hours)",
+            value=st.session_state.use_batch_api, key="batch_api_checkbox"
+        )
+        with st.expander("🔎 Check Batch Status"):
+            batch_id_to_check = st.text_input("Batch ID:", value=st.session_state.get('last_batch_id', ""), key="batch_id_input").strip()
+            if st.button("Check Status / Collect Results", key="check_batch_button", disabled=not batch_id_to_check):
+                try:
+                    with st.spinner("Checking batch..."):
+                        batch_finished, batch_message = collect_batch_results(batch_id_to_check)
+                    (st.success if batch_finished else st.info)(batch_message)
+                except Exception as e:
+                    st.error(f"Could not check batch `{batch_id_to_check}`: {e}")
 
     with col_run_single:
-        if st.button("🧪 Test with FIRST Topic Only", use_container_width=True, help="Quickly test current settings using only the first topic in the list.", key="gen_first_button"):
+        if st.button("🧪 Test with FIRST Topic Only", use_container_width=True, help="Quickly test current settings using only the first topic in the list.", key="gen_first_button", disabled=generation_running):
             st.session_state.run_mode = "first_only"
             st.session_state.trigger_generation = True
+        # Next to the run buttons: clearing and re-running is the usual way to get fresh variations.
+        if st.button("🧹 Clear LLM Cache", use_container_width=True, key="clear_llm_cache_button", help="Forget cached AI responses so the next run calls the provider again.", disabled=generation_running):
+            get_llm_cache().clear()
+            st.success("LLM response cache cleared.")
 
     if 'trigger_generation' in st.session_state and st.session_state.trigger_generation:
-        st.write("DEBUG: Generation process triggered.") # Added logging
+        logger.debug("Generation process triggered.")
         st.session_state.trigger_generation = False # Reset trigger
         
-        topics_df_to_process = st.session_state.topics_df.copy() # Use a copy to avoid modifying session state during iteration
+        topics_df_to_process = st.session_state.topics_df # Never mutated in place (edits replace the frame), so no copy
         if topics_df_to_process.empty:
             st.warning("No topics to process. Please upload a CSV or add topics in the editor.")
-            st.write("DEBUG: No topics to process. Stopping generation.") # Added logging
+            logger.debug("No topics to process. Stopping generation.")
             st.stop()
 
-        st.write(f"DEBUG: Run mode: {st.session_state.run_mode}") # Added logging
+        logger.debug("Run mode: %s", st.session_state.run_mode)
         if st.session_state.run_mode == "first_only":
             topics_df_to_process = topics_df_to_process.head(1)
             if topics_df_to_process.empty:
                 st.warning("No topics available to test with 'First Topic Only'. Add topics to the editor."); 
-                st.write("DEBUG: No topics available for 'first_only' mode. Stopping generation.") # Added logging
+                logger.debug("No topics available for 'first_only' mode. Stopping generation.")
                 st.stop()
             st.info(f"🧪 Test Mode: Processing only the first topic: '{topics_df_to_process.iloc[0].get('topic_input', 'N/A')}'")
         
-        st.write(f"DEBUG: Number of topics to process: {len(topics_df_to_process)}") # Added logging
-        st.info(f"🚀 Starting content generation for {len(topics_df_to_process)} topic(s) using {st.session_state.model_name}...")
-        all_generated_data_list = []
-        progress_bar = st.progress(0.0)
-        status_text_area = st.empty()
-        current_prompts = st.session_state.editable_prompts
-
-        st.write("DEBUG: Entering main loop for topics.") # Added logging
-        for i, topic_row in enumerate(topics_df_to_process.to_dict(orient='records')):
-            current_progress = (i + 1) / len(topics_df_to_process)
-            topic_input_val = topic_row.get('topic_input', 'N/A')
-            primary_keyword_val = topic_row.get('primary_keyword', '')
-            secondary_keywords_val = topic_row.get('secondary_keywords', '')
-            st.write(f"DEBUG: Processing topic {i+1}/{len(topics_df_to_process)}: '{topic_input_val}'") # Added logging
-            status_text_area.info(f"🔄 Processing: **{topic_input_val}** ({i+1} of {len(topics_df_to_process)})..." )
-            output_row = {"topic_input": topic_input_val,"primary_keyword": primary_keyword_val,"secondary_keywords": secondary_keywords_val}
-            
-            st.write(f"DEBUG: Entering inner loop for fields for topic: '{topic_input_val}'") # Added logging
-            for field_to_gen in ["page_title", "meta_description", "h1_tag", "subtitle", "alt_text", "main_text_html"]:
-                st.write(f"DEBUG: Preparing to generate field '{field_to_gen}' for topic '{topic_input_val}'.") # Added logging
-                prompt_template = current_prompts.get(field_to_gen)
-                if not prompt_template:
-                    st.warning(f"Prompt for '{field_to_gen}' missing for '{topic_input_val}'."); output_row[field_to_gen] = "ERROR: No Prompt"; 
-                    st.write(f"DEBUG: No prompt for '{field_to_gen}'. Skipping.") # Added logging
-                    continue
-                status_text_area.info(f"🔄 Generating `{field_to_gen}` for: **{topic_input_val}**...")
-                fmt_prompt = prompt_template
-                fmt_prompt = fmt_prompt.replace("[TOPIC_INPUT]", topic_input_val)
-                fmt_prompt = fmt_prompt.replace("[PRIMARY_KEYWORD]", primary_keyword_val)
-                fmt_prompt = fmt_prompt.replace("[SECONDARY_KEYWORDS_LIST]", secondary_keywords_val)
-                fmt_prompt = fmt_prompt.replace("[WORKSTREAM_BRAND_GUIDELINES]", st.session_state.brand_guidelines)
-                fmt_prompt = fmt_prompt.replace("[SEO_BEST_PRACTICES_SUMMARY]", st.session_state.seo_summary)
-                fmt_prompt = fmt_prompt.replace("[APPROVED_INTERNAL_LINKS_TEXT]", st.session_state.approved_internal_links)
-                fmt_prompt = fmt_prompt.replace("[APPROVED_EXTERNAL_LINKS_TEXT]", st.session_state.approved_external_links)
-                fmt_prompt = fmt_prompt.replace("[TARGET_NUMBER_INTERNAL_LINKS]", str(st.session_state.target_internal_links))
-                fmt_prompt = fmt_prompt.replace("[TARGET_NUMBER_EXTERNAL_LINKS]", str(st.session_state.target_external_links))
-                
-                st.write(f"DEBUG: Calling generate_content for '{field_to_gen}' on topic '{topic_input_val}'.") # Added logging
-                generated_val = generate_content(fmt_prompt, st.session_state.model_name, st.session_state.llm_temperature)
-                st.write(f"DEBUG: Received from generate_content for '{field_to_gen}': {generated_val[:100] if isinstance(generated_val, str) else 'ERROR_OBJECT'}...") # Added logging
-
-                output_row[field_to_gen] = generated_val
-                if field_to_gen == "main_text_html" and isinstance(generated_val, str):
-                    # Corrected link detection:
-                    # Extract the full URL part (before the first colon) from the approved lists
-                    approved_internal_urls_full = []
-                    for line in st.session_state.approved_internal_links.splitlines():
-                        line_content = line.strip()
-                        if line_content and ":" in line_content: # Ensure there's a colon
-                            url_to_add = ""
-                            # Try to split by ": " first (colon followed by space)
-                            parts_by_colon_space = line_content.split(": ", 1)
-                            if len(parts_by_colon_space) == 2:
-                                url_to_add = parts_by_colon_space[0].strip()
-                            else:
-                                # Fallback: if ": " not found or doesn't split cleanly, use rsplit on just ":"
-                                parts_by_last_colon = line_content.rsplit(":", 1)
-                                if parts_by_last_colon: # Should be true if ":" is in line_content
-                                    url_to_add = parts_by_last_colon[0].strip()
-                            
-                            if url_to_add:
-                                approved_internal_urls_full.append(url_to_add)
-                    
-                    approved_external_urls_full = []
-                    for line in st.session_state.approved_external_links.splitlines():
-                        line_content = line.strip()
-                        if line_content and ":" in line_content: # Ensure there's a colon
-                            url_to_add = ""
-                            # Try to split by ": " first (colon followed by space)
-                            parts_by_colon_space = line_content.split(": ", 1)
-                            if len(parts_by_colon_space) == 2:
-                                url_to_add = parts_by_colon_space[0].strip()
-                            else:
-                                # Fallback: if ": " not found or doesn't split cleanly, use rsplit on just ":"
-                                parts_by_last_colon = line_content.rsplit(":", 1)
-                                if parts_by_last_colon: # Should be true if ":" is in line_content
-                                    url_to_add = parts_by_last_colon[0].strip()
-                            
-                            if url_to_add:
-                                approved_external_urls_full.append(url_to_add)
-
-                    output_row["found_internal_links_in_html"] = " | ".join(
-                        [url for url in approved_internal_urls_full if url in generated_val]
-                    )
-                    output_row["found_external_links_in_html"] = " | ".join(
-                        [url for url in approved_external_urls_full if url in generated_val]
-                    )
-                time.sleep(0.05) 
-            all_generated_data_list.append(output_row)
-            progress_bar.progress(current_progress)
-        status_text_area.success(f"✅ Content generation complete for {len(topics_df_to_process)} topic(s)!")
-        if all_generated_data_list:
-            results_final_df = pd.DataFrame(all_generated_data_list, columns=CSV_COLUMN_HEADERS)
-            st.subheader("📊 Generated Content Results")
-            st.dataframe(results_final_df, height=600, use_container_width=True)
-            @st.cache_data
-            def convert_df_to_csv_bytes_final(df_to_convert): return df_to_convert.to_csv(index=False).encode('utf-8')
-            csv_final_bytes = convert_df_to_csv_bytes_final(results_final_df)
-            st.download_button(label="📥 Download All Results as CSV",data=csv_final_bytes,file_name=f"ai_seo_content_{st.session_state.model_name.replace('/', '-')}_{time.strftime('%Y%m%d-%H%M%S')}.csv",mime="text/csv")
-        else: st.warning("No data was generated. Check inputs and configurations.")
+        logger.debug("Number of topics to process: %d", len(topics_df_to_process))
+        use_batch_api = st.session_state.run_mode == "all" and st.session_state.use_batch_api
+        if use_batch_api and "gemini" in st.session_state.model_name:
+            st.warning("Batch jobs are only available for OpenAI and Anthropic models. Running live requests instead.")
+            use_batch_api = False
+
+        generation_settings = {
+            'model_name': st.session_state.model_name,
+            'llm_temperature': st.session_state.llm_temperature,
+            'max_concurrency': st.session_state.max_concurrency,
+            'rate_limiter': get_rate_limiter(st.session_state.model_name, st.session_state.requests_per_minute) if st.session_state.requests_per_minute else None,
+            'combine_short_fields': st.session_state.combine_short_fields,
+            'topics_per_request': st.session_state.topics_per_request,
+            'use_batch_api': use_batch_api,
+            'prompt_templates': dict(st.session_state.editable_prompts),
+            'prompt_context': build_prompt_context(),
+            # Built once per pair of link lists (cached across runs), not per topic or per article in the job.
+            'link_matchers': get_link_matchers(st.session_state.approved_internal_links, st.session_state.approved_external_links),
+            'llm_cache': get_llm_cache(),
+            'llm_client': get_llm_client(st.session_state.model_name),
+            'batch_client': get_batch_client(st.session_state.model_name) if use_batch_api else None,
+            'batch_manifest_cache': get_batch_manifest_cache() if use_batch_api else None,
+        }
+        if use_batch_api and generation_settings['batch_client'] is None:
+            st.error(f"API key for '{st.session_state.model_name}' not configured. Cannot submit a batch job.")
+            st.stop()
+        # Arrow hands over whole columns as Python lists (no per-cell pandas boxing); missing cells become None.
+        start_generation_job(pa.Table.from_pandas(topics_df_to_process, preserve_index=False).to_pylist(), generation_settings)
+
+    generation_job = st.session_state.get('generation_job')
+    if generation_job and generation_job['state'] == "running":
+        st.info(f"🚀 Generating content for {generation_job['topic_count']} topic(s) using {generation_job['model_name']}...")
+        render_generation_progress()
+    elif generation_job:
+        if generation_job['state'] == "complete":
+            st.success(f"✅ Content generation complete for {generation_job['topic_count']} topic(s)!")
+        elif generation_job['state'] == "cancelled":
+            st.warning("Generation cancelled.")
+        else:
+            st.error("Generation failed. See the log below.")
+        if generation_job['log']:
+            with st.expander("Generation log"):
+                for log_line in generation_job['log']:
+                    st.markdown(log_line)
+        results_final_df = generation_job['results_df']
+        if results_final_df is not None and not results_final_df.empty:
+            if not generation_job.get('results_saved'):
+                # Kept apart from the job, so these results survive starting (or cancelling) the next run.
+                st.session_state.last_results = {
+                    'results_df': results_final_df, 'results_csv': generation_job['results_csv'],
+                    'model_name': generation_job['model_name'], 'topic_count': generation_job['topic_count'],
+                    'finished_at': time.strftime('%Y%m%d-%H%M%S'),
+                }
+                generation_job['results_saved'] = True
+        elif generation_job['state'] == "complete": st.warning("No data was generated. Check inputs and configurations.")
+
+    last_results = st.session_state.get('last_results')
+    if last_results is not None:
+        new_run_in_progress = generation_job is not None and generation_job['state'] == "running"
+        st.subheader("📊 Previous Results" if new_run_in_progress else "📊 Generated Content Results")
+        st.caption(f"{last_results['topic_count']} topic(s) · `{last_results['model_name']}` · finished {last_results['finished_at']}")
+        st.dataframe(last_results['results_df'], height=600, use_container_width=True)
+        st.download_button(label="📥 Download All Results as CSV",data=last_results['results_csv'],file_name=f"ai_seo_content_{last_results['model_name'].replace('/', '-')}_{last_results['finished_at']}.csv",mime="text/csv")
 
 
 # --- Footer ---
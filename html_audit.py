@@ -0,0 +1,49 @@
+# --- GENERATED HTML AUDIT ---
+# Lives outside app.py so worker processes can import (and pickle a reference to) audit_row:
+# Streamlit executes app.py as a script, which a child process can't import by name.
+from selectolax.parser import HTMLParser
+
+# Tags the main_text_html prompt allows in the article body.
+ALLOWED_BODY_TAGS = frozenset({"p", "h2", "h3", "ul", "li", "strong", "em", "a"})
+
+def build_link_matcher(approved_url_pairs):
+    # match key -> [(position in the approved list, url), ...]. An article's few links are looked up here
+    # instead of every approved URL being checked against each article.
+    link_matcher = {}
+    for position, (url, url_key) in enumerate(approved_url_pairs):
+        link_matcher.setdefault(url_key, []).append((position, url))
+    return link_matcher
+
+def join_linked_urls(linked_keys, link_matcher):
+    # Approved URLs (in list order) whose match key is among the article's link targets.
+    found = sorted(entry for url_key in linked_keys for entry in link_matcher.get(url_key, ()))
+    return " | ".join(url for _, url in found)
+
+def audit_row(main_text_html, internal_link_matcher, external_link_matcher):
+    # One parse per article: approved links it contains, plus any tags outside the whitelist.
+    # Returns (found_internal_links, found_external_links, html_issues).
+    if not isinstance(main_text_html, str) or not main_text_html or main_text_html.startswith("ERROR:"):
+        return "", "", ""
+    linked_keys = set() # href targets, trailing slash stripped to match approved_url_keys
+    disallowed_tags = set()
+    for node in HTMLParser(main_text_html).css("body *"):
+        if node.tag == "a" and node.attributes.get("href"):
+            linked_keys.add(node.attributes["href"].strip().rstrip("/"))
+        elif node.tag not in ALLOWED_BODY_TAGS:
+            disallowed_tags.add(node.tag)
+    html_issues = f"Disallowed tags: {', '.join(sorted(disallowed_tags))}" if disallowed_tags else ""
+    return (
+        join_linked_urls(linked_keys, internal_link_matcher),
+        join_linked_urls(linked_keys, external_link_matcher),
+        html_issues,
+    )
+
+# Set once per worker process by the pool initializer, so the matchers aren't re-pickled with every chunk of articles.
+worker_link_matchers = ({}, {})
+
+def init_audit_worker(link_matchers):
+    global worker_link_matchers
+    worker_link_matchers = link_matchers
+
+def audit_article(main_text_html):
+    return audit_row(main_text_html, *worker_link_matchers)